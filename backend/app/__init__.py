@@ -1,6 +1,8 @@
 import os
+import logging
 from flask import Flask
 from flask_cors import CORS
+from flask_compress import Compress
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -9,6 +11,15 @@ load_dotenv()
 
 def create_app():
     """Application factory pattern for Flask app."""
+    from app.utils import LOG_FORMAT, EpochFormatter
+    
+    # Configure logging once per process; a no-op if the server (or an earlier
+    # create_app call) already installed root handlers
+    if not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(EpochFormatter(LOG_FORMAT))
+        logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(), handlers=[handler])
+    
     app = Flask(__name__)
     
     # Configuration from environment
@@ -16,16 +27,42 @@ def create_app():
     app.config['DEBUG'] = os.getenv('FLASK_DEBUG', '0') == '1'
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
     
+    # Serialize JSON responses with orjson
+    from app.utils import ORJSONProvider, UploadRequest
+    app.json = ORJSONProvider(app)
+    
+    # Keep uploads in memory so they can be read without copying
+    app.request_class = UploadRequest
+    
+    # Compress JSON responses (extraction results and listings run to tens of KB);
+    # SSE progress streams are text/event-stream and pass through uncompressed
+    app.config['COMPRESS_MIMETYPES'] = ['application/json']
+    app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+    app.config['COMPRESS_LEVEL'] = 4
+    app.config['COMPRESS_BR_LEVEL'] = 4
+    app.config['COMPRESS_MIN_SIZE'] = 1024
+    Compress(app)
+    
     # CORS configuration
     cors_origins = os.getenv('CORS_ORIGINS', 'http://localhost:3000')
-    CORS(app, origins=cors_origins.split(','))
+    CORS(app, origins=cors_origins.split(','), expose_headers=['X-Response-Time-Ms'])
     
     # Register error handlers
     from app.errors import register_error_handlers
     register_error_handlers(app)
     
+    # Time and log every request
+    from app.utils import register_request_timing
+    register_request_timing(app)
+    
     # Register blueprints/routes
     from app.routes import api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
     
+    # Load reference data up front; under `gunicorn --preload` this runs once in the
+    # master and forked workers inherit the warm cache
+    if os.getenv('DB_WARMUP', '1') == '1':
+        from app.database import db
+        db.warmup()
+    
     return app
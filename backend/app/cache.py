@@ -0,0 +1,196 @@
+"""
+Caches of LLM extraction results.
+Identical image bytes (ExtractionCache) or near-identical images (SemanticCache)
+extracted under the same prompt and models are served from disk instead of
+calling the LLM again.
+"""
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+import orjson
+from contextlib import closing
+from datetime import datetime, timezone
+from typing import Optional, List, Dict, Any
+
+from app.database import _run_blocking
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'extraction_cache'
+)
+
+
+class ExtractionCache:
+    """
+    On-disk JSON cache keyed by SHA-256 of the image bytes.
+    - One file per entry: {cache_dir}/{key}.json
+    - Entries are written atomically, so concurrent workers never read a partial file
+    """
+    
+    def __init__(self, cache_dir: str, namespace: str):
+        """
+        Args:
+            cache_dir: Directory holding cache entries
+            namespace: Prompt/model configuration; changing it invalidates all entries
+        """
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"Could not create extraction cache directory {cache_dir}: {e}")
+    
+    def key_for(self, image_data: bytes) -> str:
+        """Cache key for an image under the current namespace."""
+        digest = hashlib.sha256(self.namespace.encode())
+        # Length prefix keeps key material unambiguous across namespaces and payloads
+        digest.update(len(image_data).to_bytes(8, 'big'))
+        digest.update(image_data)
+        return digest.hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached result fields for a key, or None on a miss."""
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable extraction cache entry {key}: {e}")
+            return None
+        return entry.get('result')
+    
+    def put(self, key: str, result: Dict[str, Any], metadata: Dict[str, Any] = None):
+        """Store result fields under a key, with an audit trail of when and how they were produced."""
+        entry = {
+            'key': key,
+            'namespace': self.namespace,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'metadata': metadata or {},
+            'result': result
+        }
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(entry))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write extraction cache entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class SemanticCache:
+    """
+    SQLite cache of extraction results keyed by a 64-bit perceptual hash (pHash)
+    of the decoded image, so re-scans and re-encodes of the same page hit too.
+    - Each hash is split into 8 byte buckets; two hashes within Hamming distance 7
+      share at least one bucket, so lookups only compare rows from matching buckets
+    - Only images Pillow can decode are hashed (PDFs are skipped)
+    """
+    
+    BUCKETS = 8
+    
+    def __init__(self, cache_dir: str, namespace: str, max_distance: int = 4):
+        """
+        Args:
+            cache_dir: Directory holding the semantic.sqlite database
+            namespace: Prompt/model configuration; entries from other namespaces are ignored
+            max_distance: Largest Hamming distance (0-7) treated as the same image
+        """
+        try:
+            import imagehash  # noqa: F401
+        except ImportError:
+            raise ImportError("imagehash package not installed. Run: pip install imagehash")
+        
+        self.db_path = os.path.join(cache_dir, 'semantic.sqlite')
+        self.namespace = namespace
+        self.max_distance = min(max_distance, self.BUCKETS - 1)
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        buckets = ', '.join(f'b{i} INTEGER' for i in range(self.BUCKETS))
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS entries ('
+                    f'phash TEXT, namespace TEXT, {buckets}, created_at TEXT, result TEXT)'
+                )
+                for i in range(self.BUCKETS):
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS idx_b{i} ON entries (b{i})')
+    
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30)
+    
+    def image_hash(self, image) -> Optional[int]:
+        """
+        64-bit pHash of an opened Pillow image, or None if there is no image or
+        its pixels can't be decoded.
+        Decoding happens on the caller's image object, so later steps reuse the pixels.
+        """
+        import imagehash
+        
+        if image is None:
+            return None
+        try:
+            return int(str(imagehash.phash(image)), 16)
+        except Exception as e:
+            logger.debug(f"Skipping perceptual hash: {e}")
+            return None
+    
+    def _buckets(self, phash: int) -> List[int]:
+        return [(phash >> (8 * i)) & 0xFF for i in range(self.BUCKETS)]
+    
+    def get(self, phash: int) -> Optional[Dict[str, Any]]:
+        """Return the result fields of the closest cached image within max_distance, or None."""
+        where = ' OR '.join(f'b{i} = ?' for i in range(self.BUCKETS))
+        try:
+            with closing(self._connect()) as conn:
+                rows = conn.execute(
+                    f'SELECT phash, result FROM entries WHERE namespace = ? AND ({where})',
+                    [self.namespace, *self._buckets(phash)]
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read semantic cache: {e}")
+            return None
+        
+        best = None
+        for candidate, result in rows:
+            distance = (int(candidate, 16) ^ phash).bit_count()
+            if distance <= self.max_distance and (best is None or distance < best[0]):
+                best = (distance, result)
+        
+        if best is None:
+            return None
+        logger.info(f"Semantic cache hit at Hamming distance {best[0]}")
+        return orjson.loads(best[1])
+    
+    def put(self, phash: int, result: Dict[str, Any]):
+        """
+        Store result fields under an image's perceptual hash.
+        The insert runs through _run_blocking, so under gevent waiting for another
+        worker's write lock doesn't stall every request in this one.
+        """
+        columns = ', '.join(f'b{i}' for i in range(self.BUCKETS))
+        placeholders = ', '.join('?' for _ in range(self.BUCKETS + 4))
+        row = [f'{phash:016x}', self.namespace, *self._buckets(phash),
+               datetime.now(timezone.utc).isoformat(), orjson.dumps(result).decode()]
+        
+        def insert():
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    f'INSERT INTO entries (phash, namespace, {columns}, created_at, result) VALUES ({placeholders})',
+                    row
+                )
+        
+        try:
+            _run_blocking(insert)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write semantic cache entry: {e}")
@@ -1,27 +1,42 @@
 """
-Database module for Excel/Pandas operations.
+Database module for Excel/Pandas and SQLite operations.
 Uses Case Study Data.xlsx for reference data (read-only).
-Uses Extracted_Orders.xlsx for newly extracted invoice data (read/write).
+Uses Extracted_Orders.sqlite for newly extracted invoice data (read/write).
 """
 import os
+import queue
+import sqlite3
+import threading
+import time
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from contextlib import closing
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Paths to Excel files
+# Paths to data files
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data')
 REFERENCE_FILE = os.path.join(DATA_DIR, 'Case Study Data.xlsx')
-EXTRACTED_FILE = os.path.join(DATA_DIR, 'Extracted_Orders.xlsx')
+EXTRACTED_FILE = os.path.join(DATA_DIR, 'Extracted_Orders.sqlite')
+
+# openpyxl read options: stream rows and skip formulas/external links
+# instead of materializing the full workbook cell grid
+EXCEL_READ_OPTIONS = {
+    'engine': 'openpyxl',
+    'engine_kwargs': {'read_only': True, 'data_only': True, 'keep_links': False}
+}
 
 
 class Database:
     """
-    Excel-based database using pandas.
+    Excel/SQLite-backed database using pandas.
     - Reference data from Case Study Data.xlsx (read-only)
-    - Extracted orders saved to Extracted_Orders.xlsx (read/write)
+    - Extracted orders saved to Extracted_Orders.sqlite (read/write)
     """
     
     # Sheets in reference file (read-only)
@@ -37,129 +52,354 @@ class Database:
         'store_customers': 'StoreCustomers'
     }
     
-    # Sheets in extracted file (read/write)
-    EXTRACTED_SHEETS = {
+    # Columns kept in memory per reference sheet; sheets not listed keep every column.
+    # Only sheets no endpoint returns whole may be projected: orders, order details,
+    # products and customers are serialized with all their columns.
+    # Sidecars store the full sheet, so changing this does not require a rebuild.
+    REFERENCE_COLUMNS = {
+        'individual_customers': ['BusinessEntityID', 'FirstName', 'LastName'],
+        'store_customers': ['BusinessEntityID', 'Name']
+    }
+    
+    # Integer key and code columns stored as int32 when they fit (no nulls, integral values)
+    INT32_COLUMNS = (
+        'SalesOrderID', 'SalesOrderDetailID', 'CustomerID', 'ProductID',
+        'BusinessEntityID', 'PersonID', 'StoreID', 'TerritoryID', 'SpecialOfferID', 'Status'
+    )
+    
+    # Tables in extracted database (read/write)
+    EXTRACTED_TABLES = {
         'extracted_orders': 'ExtractedOrders',
         'extracted_details': 'ExtractedOrderDetails'
     }
     
+    # Column definitions (SQLite type affinity) for the extracted tables
+    EXTRACTED_COLUMNS = {
+        'extracted_orders': {
+            'SalesOrderID': 'INTEGER PRIMARY KEY',
+            'SalesOrderNumber': 'TEXT',
+            'OrderDate': 'TEXT',
+            'CustomerID': 'NUMERIC',
+            'SubTotal': 'REAL',
+            'TaxAmt': 'REAL',
+            'Freight': 'REAL',
+            'TotalDue': 'REAL',
+            'Status': 'INTEGER',
+            'OnlineOrderFlag': 'INTEGER',
+            'InvoiceNumber': 'TEXT',
+            'CompanyName': 'TEXT',
+            'Provider': 'TEXT',
+            'Confidence': 'REAL',
+            'ExtractedAt': 'TEXT'
+        },
+        'extracted_details': {
+            'SalesOrderDetailID': 'INTEGER PRIMARY KEY',
+            'SalesOrderID': 'INTEGER',
+            'ProductID': 'INTEGER',
+            'ProductNumber': 'TEXT',
+            'ProductName': 'TEXT',
+            'OrderQty': 'REAL',
+            'UnitPrice': 'REAL',
+            'UnitPriceDiscount': 'REAL',
+            'SpecialOfferID': 'INTEGER',
+            'LineTotal': 'REAL',
+            '_description': 'TEXT',
+            '_item_number': 'TEXT'
+        }
+    }
+    
+    # Bound parameters per statement; 999 is the lowest default across SQLite builds
+    SQLITE_MAX_VARIABLES = 999
+    
     def __init__(self, reference_path: str = None, extracted_path: str = None):
-        """Initialize database with Excel file paths."""
+        """Initialize database with reference workbook and extracted database paths."""
         self.reference_path = reference_path or REFERENCE_FILE
         self.extracted_path = extracted_path or EXTRACTED_FILE
         self._cache = {}
         self._cache_time = {}
         self._cache_ttl = 60
+        # Lookup structures computed from cached tables, keyed by (source cache keys, name)
+        self._derived = {}
+        # Coalesces order saves from concurrent requests into shared transactions
+        self.writer = BatchWriter(self)
         
         # Initialize extracted orders file if it doesn't exist
         self._init_extracted_file()
     
     def _init_extracted_file(self):
-        """Create the extracted orders Excel file if it doesn't exist."""
+        """Create the extracted orders database and its tables if they don't exist."""
         # Create data directory if it doesn't exist
         data_dir = os.path.dirname(self.extracted_path)
         if not os.path.exists(data_dir):
             os.makedirs(data_dir, exist_ok=True)
             logger.info(f"Created data directory: {data_dir}")
         
-        if not os.path.exists(self.extracted_path):
-            logger.info(f"Creating new extracted orders file: {self.extracted_path}")
-            
-            # Create empty DataFrames with proper columns
-            orders_df = pd.DataFrame(columns=[
-                'SalesOrderID', 'SalesOrderNumber', 'OrderDate', 'CustomerID',
-                'SubTotal', 'TaxAmt', 'Freight', 'TotalDue', 'Status',
-                'InvoiceNumber', 'CompanyName', 'ExtractedAt', 'Confidence', 'Provider'
-            ])
-            
-            details_df = pd.DataFrame(columns=[
-                'SalesOrderDetailID', 'SalesOrderID', 'ProductID', 'ProductNumber',
-                'ProductName', 'OrderQty', 'UnitPrice', 'LineTotal'
-            ])
-            
-            with pd.ExcelWriter(self.extracted_path, engine='openpyxl') as writer:
-                orders_df.to_excel(writer, sheet_name='ExtractedOrders', index=False)
-                details_df.to_excel(writer, sheet_name='ExtractedOrderDetails', index=False)
-            
-            logger.info("Created extracted orders file with empty sheets")
+        is_new = not os.path.exists(self.extracted_path)
+        if is_new:
+            logger.info(f"Creating new extracted orders database: {self.extracted_path}")
+        
+        with closing(self._connect()) as conn:
+            # WAL lets readers proceed while another worker is writing
+            conn.execute('PRAGMA journal_mode=WAL')
+            with conn:
+                for table_key, columns in self.EXTRACTED_COLUMNS.items():
+                    column_defs = ', '.join(f'"{name}" {affinity}' for name, affinity in columns.items())
+                    conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.EXTRACTED_TABLES[table_key]}" ({column_defs})')
+                conn.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_details_order '
+                    'ON "ExtractedOrderDetails" ("SalesOrderID")'
+                )
+        
+        # One-time import of orders saved by earlier versions to Extracted_Orders.xlsx
+        legacy_path = os.path.splitext(self.extracted_path)[0] + '.xlsx'
+        if is_new and legacy_path != self.extracted_path and os.path.exists(legacy_path):
+            self._import_legacy_workbook(legacy_path)
+    
+    def _import_legacy_workbook(self, legacy_path: str):
+        """
+        Copy orders from a legacy Extracted_Orders.xlsx into the SQLite tables.
+        A sheet missing from the workbook is logged and skipped, so the other tables still import.
+        """
+        with closing(self._connect()) as conn, conn:
+            for table_key, table in self.EXTRACTED_TABLES.items():
+                try:
+                    df = pd.read_excel(legacy_path, sheet_name=table, **EXCEL_READ_OPTIONS)
+                except ValueError as e:
+                    logger.warning(f"Skipping '{table}' from {legacy_path}: {e}")
+                    continue
+                for col, dtype in df.dtypes.items():
+                    if pd.api.types.is_datetime64_any_dtype(dtype):
+                        df[col] = self._isoformat_datetimes(df[col])
+                rows = df.astype(object).where(df.notna(), None).to_dict('records')
+                self._insert_rows(conn, table_key, rows)
+                logger.info(f"Imported {len(rows)} rows into '{table}' from {legacy_path}")
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the extracted orders database."""
+        return sqlite3.connect(self.extracted_path, timeout=30)
+    
+    def _reference_sidecar_path(self, sheet_key: str) -> str:
+        """Path of the parquet sidecar holding a parsed reference sheet."""
+        return os.path.join(os.path.dirname(self.reference_path), f"ref_{sheet_key}.parquet")
+    
+    def _load_reference_sheet(self, sheet_key: str, sheet_name: str) -> pd.DataFrame:
+        """
+        Load a reference sheet from its parquet sidecar, projected to REFERENCE_COLUMNS.
+        The sidecar is (re)built from Excel when missing or older than the workbook,
+        so openpyxl only parses each sheet once.
+        """
+        sidecar = self._reference_sidecar_path(sheet_key)
+        reference_mtime = os.path.getmtime(self.reference_path)
+        wanted = self.REFERENCE_COLUMNS.get(sheet_key)
+        
+        if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= reference_mtime:
+            logger.info(f"Loading reference sheet '{sheet_name}' from {os.path.basename(sidecar)}")
+            columns = None
+            if wanted:
+                columns = [col for col in pq.read_schema(sidecar).names if col in wanted]
+            # memory_map only saves copying the compressed file into a read buffer:
+            # zstd decoding still writes the columns to this process's heap. Workers
+            # share the loaded tables because the app is preloaded in the gunicorn
+            # master and forked copy-on-write, not through the page cache.
+            return pd.read_parquet(sidecar, engine='pyarrow', columns=columns, memory_map=True)
+        
+        logger.info(f"Loading reference sheet '{sheet_name}' from Excel")
+        df = pd.read_excel(self.reference_path, sheet_name=sheet_name, **EXCEL_READ_OPTIONS)
+        
+        # Write to a temp file first so concurrent readers never see a partial sidecar
+        tmp_path = f"{sidecar}.{os.getpid()}.tmp"
+        try:
+            df.to_parquet(tmp_path, engine='pyarrow', compression='zstd', index=False)
+            os.replace(tmp_path, sidecar)
+        except Exception as e:
+            logger.warning(f"Could not write parquet sidecar for '{sheet_name}': {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        
+        if wanted:
+            df = df[[col for col in df.columns if col in wanted]]
+        
+        return df
     
     def _get_reference_sheet(self, sheet_key: str, force_refresh: bool = False) -> pd.DataFrame:
-        """Get a sheet from the reference file (Case Study Data.xlsx)."""
+        """
+        Get a sheet from the reference file (Case Study Data.xlsx).
+        The reference file is read-only, so sheets stay cached for the process lifetime.
+        """
         cache_key = f"ref_{sheet_key}"
-        now = datetime.now().timestamp()
         
         if not force_refresh and cache_key in self._cache:
-            if now - self._cache_time.get(cache_key, 0) < self._cache_ttl:
-                return self._cache[cache_key]
+            return self._cache[cache_key]
         
         sheet_name = self.REFERENCE_SHEETS.get(sheet_key)
         if not sheet_name:
             raise ValueError(f"Unknown reference sheet key: {sheet_key}")
         
-        logger.info(f"Loading reference sheet '{sheet_name}'")
-        df = pd.read_excel(self.reference_path, sheet_name=sheet_name)
-        
-        self._cache[cache_key] = df
-        self._cache_time[cache_key] = now
+        df = self._prepare_reference_sheet(sheet_key, sheet_name)
+        self._cache_table(cache_key, df)
         
         return df
     
-    def _get_extracted_sheet(self, sheet_key: str, force_refresh: bool = False) -> pd.DataFrame:
-        """Get a sheet from the extracted orders file."""
-        cache_key = f"ext_{sheet_key}"
-        now = datetime.now().timestamp()
+    def _prepare_reference_sheet(self, sheet_key: str, sheet_name: str) -> pd.DataFrame:
+        """Load a reference sheet and shrink its dtypes for caching."""
+        return self._optimize_dtypes(self._load_reference_sheet(sheet_key, sheet_name), categorize=True)
+    
+    def warmup(self) -> int:
+        """
+        Load every reference sheet into the cache in parallel.
+        Sheets are parsed on native worker threads (see _thread_pool); results are
+        cached on the calling thread.
         
-        if not force_refresh and cache_key in self._cache:
-            if now - self._cache_time.get(cache_key, 0) < self._cache_ttl:
-                return self._cache[cache_key]
+        Returns:
+            Number of sheets loaded
+        """
+        if not os.path.exists(self.reference_path):
+            logger.warning(f"Reference file not found, skipping warmup: {self.reference_path}")
+            return 0
         
-        sheet_name = self.EXTRACTED_SHEETS.get(sheet_key)
-        if not sheet_name:
-            raise ValueError(f"Unknown extracted sheet key: {sheet_key}")
+        start = time.monotonic()
+        pending = {
+            key: name for key, name in self.REFERENCE_SHEETS.items()
+            if f"ref_{key}" not in self._cache
+        }
+        if not pending:
+            return 0
         
-        logger.info(f"Loading extracted sheet '{sheet_name}'")
-        df = pd.read_excel(self.extracted_path, sheet_name=sheet_name)
+        with _thread_pool(len(pending)) as executor:
+            futures = {
+                key: executor.submit(self._prepare_reference_sheet, key, name)
+                for key, name in pending.items()
+            }
+            for key, future in futures.items():
+                self._cache_table(f"ref_{key}", future.result())
         
-        self._cache[cache_key] = df
+        logger.info(f"Loaded {len(pending)} reference sheets in {time.monotonic() - start:.2f}s")
+        return len(pending)
+    
+    def _get_extracted_table(self, table_key: str, force_refresh: bool = False) -> pd.DataFrame:
+        """Get a table from the extracted orders database."""
+        cache_key = f"ext_{table_key}"
+        now = time.monotonic()
+        
+        if not force_refresh:
+            df = self._cache.get(cache_key)
+            # .get: a concurrent _invalidate_extracted may drop the timestamp between the two reads
+            if df is not None and now - self._cache_time.get(cache_key, 0) < self._cache_ttl:
+                return df
+        
+        table = self.EXTRACTED_TABLES.get(table_key)
+        if not table:
+            raise ValueError(f"Unknown extracted table key: {table_key}")
+        
+        logger.info(f"Loading extracted table '{table}'")
+        with closing(self._connect()) as conn:
+            df = pd.read_sql_query(f'SELECT * FROM "{table}"', conn)
+        
+        df = self._optimize_dtypes(df)
+        # Timestamp first, so a reader never sees the new table without its load time
         self._cache_time[cache_key] = now
+        self._cache_table(cache_key, df)
         
         return df
     
+    @classmethod
+    def _optimize_dtypes(cls, df: pd.DataFrame, categorize: bool = False) -> pd.DataFrame:
+        """
+        Shrink a loaded table in memory.
+        INT32_COLUMNS become int32 when lossless; with categorize=True, string columns
+        with many repeated values become categoricals. Monetary columns stay float64
+        so amounts serialize exactly as stored.
+        """
+        converted = {}
+        for col, dtype in df.dtypes.items():
+            series = df[col]
+            if col in cls.INT32_COLUMNS and pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+                values = series.to_numpy()
+                if (len(values) and not series.isna().any() and (values % 1 == 0).all()
+                        and values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max):
+                    converted[col] = series.astype('int32')
+            elif categorize and dtype == object:
+                non_null = series.dropna()
+                if len(non_null) and non_null.nunique() <= len(non_null) // 2 and non_null.map(type).eq(str).all():
+                    converted[col] = series.astype('category')
+        
+        return df.assign(**converted) if converted else df
+    
+    def _cache_table(self, cache_key: str, df: pd.DataFrame):
+        """Cache a loaded table and drop lookups derived from its previous version."""
+        self._cache[cache_key] = df
+        self._drop_derived(cache_key)
+    
+    def _drop_derived(self, cache_key: str):
+        """Drop all lookups derived from a cached table."""
+        # list() snapshots the keys in one step, so other threads can add lookups meanwhile
+        for key in [key for key in list(self._derived) if cache_key in key[0]]:
+            self._derived.pop(key, None)
+    
+    def _get_derived(self, cache_keys, name: str, build):
+        """
+        Get a lookup computed from one or more cached tables, building it on first use.
+        cache_keys is a single cache key or a tuple of them.
+        """
+        if isinstance(cache_keys, str):
+            cache_keys = (cache_keys,)
+        key = (tuple(cache_keys), name)
+        if key not in self._derived:
+            self._derived[key] = build()
+        return self._derived[key]
+    
+    @staticmethod
+    def _lowercase_array(series: pd.Series) -> np.ndarray:
+        """Lowercased string array for vectorized substring search."""
+        # object first: fillna('') would fail on a categorical without '' as a category
+        return series.astype(object).fillna('').astype(str).str.lower().to_numpy(dtype=str)
+    
+    @staticmethod
+    def _position_index(series: pd.Series) -> Dict[Any, int]:
+        """Map each value to the position of its first row, for O(1) lookups."""
+        keys = series.tolist()
+        # Build in reverse so the first occurrence of a duplicate key wins
+        return {key: pos for pos, key in reversed(list(enumerate(keys)))}
+    
     def clear_cache(self):
         """Clear all cached data."""
         self._cache.clear()
         self._cache_time.clear()
+        self._derived.clear()
+    
+    @staticmethod
+    def _isoformat_datetimes(series: pd.Series) -> np.ndarray:
+        """Format a datetime column as 'YYYY-MM-DDTHH:MM:SS' strings in one numpy call; NaT becomes None."""
+        if series.dt.tz is not None:
+            # Keep local wall-clock time, as strftime would
+            series = series.dt.tz_localize(None)
+        strings = np.datetime_as_string(series.to_numpy(dtype='datetime64[s]'), unit='s').astype(object)
+        strings[series.isna().to_numpy()] = None
+        return strings
     
     def _sanitize_for_json(self, df: pd.DataFrame) -> List[Dict]:
         """
-        Convert DataFrame to list of dicts, properly handling NaT and NaN values.
-        This prevents JSON serialization errors with datetime NaT values.
+        Convert DataFrame to list of dicts, with datetimes as ISO strings and
+        missing values as None. Each column is converted to Python values in
+        one pass, then the columns are zipped into records; only columns that
+        contain missing values pay for the None masking.
         """
-        import numpy as np
-        
-        # Make a copy to avoid modifying original
-        df = df.copy()
-        
-        # Convert datetime columns to string to avoid NaT serialization issues
-        for col in df.columns:
-            if pd.api.types.is_datetime64_any_dtype(df[col]):
-                df[col] = df[col].apply(lambda x: x.isoformat() if pd.notna(x) else None)
+        columns = {}
+        for col, dtype in df.dtypes.items():
+            series = df[col]
+            # Convert datetime columns to string to avoid NaT serialization issues
+            if pd.api.types.is_datetime64_any_dtype(dtype):
+                columns[col] = self._isoformat_datetimes(series).tolist()
+            elif series.hasnans:
+                # NaN is truthy, so callers checking `value or default` need None
+                values = series.to_numpy(dtype=object)
+                values[series.isna().to_numpy()] = None
+                columns[col] = values.tolist()
+            else:
+                columns[col] = series.tolist()
         
-        # Convert to records
-        records = df.to_dict('records')
-        
-        # Replace NaN/NaT with None in each record
-        cleaned_records = []
-        for record in records:
-            cleaned = {}
-            for key, value in record.items():
-                if pd.isna(value) or (isinstance(value, float) and np.isnan(value)):
-                    cleaned[key] = None
-                else:
-                    cleaned[key] = value
-            cleaned_records.append(cleaned)
-        
-        return cleaned_records
+        names = list(columns)
+        return [dict(zip(names, row)) for row in zip(*columns.values())]
     
     # =========================================================================
     # Read Operations (from both files)
@@ -176,53 +416,137 @@ class Database:
             customer_id: Filter by customer ID
             source: 'reference', 'extracted', or 'all' (default: 'extracted')
         """
-        dfs = []
-        
-        if source in ('reference', 'all'):
-            ref_df = self._get_reference_sheet('orders').copy()
-            ref_df['Source'] = 'reference'
-            dfs.append(ref_df)
-        
-        if source in ('extracted', 'all'):
-            ext_df = self._get_extracted_sheet('extracted_orders').copy()
-            ext_df['Source'] = 'extracted'
-            dfs.append(ext_df)
-        
-        if not dfs:
+        df = self._get_sorted_orders(source)
+        if df is None:
             return [], 0
         
-        df = pd.concat(dfs, ignore_index=True)
-        
-        # Apply filters
+        # Apply filters (boolean masks keep the sorted order)
         if customer_id:
             df = df[df['CustomerID'] == customer_id]
         
         total = len(df)
         
-        # Sort by SalesOrderID descending (newest first)
-        df = df.sort_values('SalesOrderID', ascending=False)
-        
         # Pagination
         start = (page - 1) * per_page
         end = start + per_page
         page_df = df.iloc[start:end]
         
-        orders = self._sanitize_for_json(page_df.copy())
+        orders = self._sanitize_for_json(page_df)
         
         return orders, total
     
+    def _get_sorted_orders(self, source: str) -> Optional[pd.DataFrame]:
+        """
+        Orders from the requested source with a Source column, sorted by
+        SalesOrderID descending (newest first). Cached until a source table reloads.
+        """
+        tables = []
+        
+        if source in ('reference', 'all'):
+            tables.append(('ref_orders', self._get_reference_sheet('orders'), 'reference'))
+        
+        if source in ('extracted', 'all'):
+            tables.append(('ext_extracted_orders', self._get_extracted_table('extracted_orders'), 'extracted'))
+        
+        if not tables:
+            return None
+        
+        def build():
+            df = self._concat_sources([table.assign(Source=label) for _, table, label in tables])
+            return df.sort_values('SalesOrderID', ascending=False, ignore_index=True)
+        
+        return self._get_derived(tuple(key for key, _, _ in tables), 'orders_newest_first', build)
+    
+    def _concat_sources(self, frames: List[pd.DataFrame]) -> pd.DataFrame:
+        """
+        Stack tables from different sources under the union of their columns.
+        - All-NA columns are dropped before the concat (pandas is deprecating
+          ignoring them when it picks result dtypes) and restored as missing values;
+          integer and boolean columns another source lacks become object first,
+          so their values aren't turned into floats by the gaps
+        - A column that is datetime in one source but text in another (OrderDate
+          parsed from Excel vs stored in SQLite) becomes ISO strings throughout,
+          rather than a mix of Timestamps and strings
+        """
+        columns = list(dict.fromkeys(col for frame in frames for col in frame.columns))
+        frames = [frame.dropna(axis=1, how='all') for frame in frames]
+        
+        if len(frames) > 1:
+            partial = {col for col in columns if not all(col in frame for frame in frames)}
+            frames = [
+                frame.astype({
+                    col: object for col, dtype in frame.dtypes.items()
+                    if col in partial and (pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype))
+                })
+                for frame in frames
+            ]
+            
+            datetime_columns = {
+                col for frame in frames for col, dtype in frame.dtypes.items()
+                if pd.api.types.is_datetime64_any_dtype(dtype)
+            }
+            mixed = [
+                col for col in datetime_columns
+                if any(col in frame and not pd.api.types.is_datetime64_any_dtype(frame[col].dtype) for frame in frames)
+            ]
+            if mixed:
+                frames = [
+                    frame.assign(**{
+                        col: self._isoformat_datetimes(frame[col]) for col in mixed
+                        if col in frame and pd.api.types.is_datetime64_any_dtype(frame[col].dtype)
+                    })
+                    for frame in frames
+                ]
+        
+        return pd.concat(frames, ignore_index=True).reindex(columns=columns)
+    
+    def get_order_by_id(self, sales_order_id: int, source: str = 'extracted') -> Optional[Dict]:
+        """
+        Get a single sales order by SalesOrderID.
+        Extracted orders are looked up by primary key in SQLite; reference orders
+        through a cached position index.
+        
+        Args:
+            sales_order_id: The SalesOrderID
+            source: 'reference', 'extracted', or 'all' (default: 'extracted')
+        
+        Returns:
+            Order dict (with Source column) or None if not found
+        """
+        if source in ('extracted', 'all'):
+            table = self.EXTRACTED_TABLES['extracted_orders']
+            with closing(self._connect()) as conn:
+                cursor = conn.execute(f'SELECT * FROM "{table}" WHERE "SalesOrderID" = ?', (sales_order_id,))
+                row = cursor.fetchone()
+                if row is not None:
+                    order = dict(zip((col[0] for col in cursor.description), row))
+                    order['Source'] = 'extracted'
+                    return order
+        
+        if source in ('reference', 'all'):
+            df = self._get_reference_sheet('orders')
+            index = self._get_derived('ref_orders', 'by_id',
+                                      lambda: self._position_index(df['SalesOrderID']))
+            pos = index.get(sales_order_id)
+            if pos is not None:
+                order = self._sanitize_for_json(df.iloc[pos:pos + 1])[0]
+                order['Source'] = 'reference'
+                return order
+        
+        return None
+    
     def get_order_details(self, sales_order_id: int) -> List[Dict]:
         """Get order details for a specific order."""
         # Check extracted first
-        ext_df = self._get_extracted_sheet('extracted_details')
+        ext_df = self._get_extracted_table('extracted_details')
         ext_filtered = ext_df[ext_df['SalesOrderID'] == sales_order_id]
         if not ext_filtered.empty:
-            return self._sanitize_for_json(ext_filtered.copy())
+            return self._sanitize_for_json(ext_filtered)
         
         # Fall back to reference
         ref_df = self._get_reference_sheet('order_details')
         ref_filtered = ref_df[ref_df['SalesOrderID'] == sales_order_id]
-        return self._sanitize_for_json(ref_filtered.copy())
+        return self._sanitize_for_json(ref_filtered)
     
     def get_products(self, page: int = 1, per_page: int = 50) -> tuple[List[Dict], int]:
         """Get products with pagination."""
@@ -233,64 +557,78 @@ class Database:
         end = start + per_page
         page_df = df.iloc[start:end]
         
-        products = page_df.where(pd.notnull(page_df), None).to_dict('records')
-        return products, total
+        return self._sanitize_for_json(page_df), total
     
     def get_product_by_number(self, product_number: str) -> Optional[Dict]:
         """Find a product by its ProductNumber."""
         df = self._get_reference_sheet('products')
-        match = df[df['ProductNumber'] == product_number]
-        if match.empty:
+        index = self._get_derived('ref_products', 'by_number',
+                                  lambda: self._position_index(df['ProductNumber']))
+        pos = index.get(product_number)
+        if pos is None:
             return None
-        return match.iloc[0].where(pd.notnull(match.iloc[0]), None).to_dict()
+        return self._sanitize_for_json(df.iloc[pos:pos + 1])[0]
     
     def get_customer(self, customer_id: int) -> Optional[Dict]:
         """Get customer by ID."""
         df = self._get_reference_sheet('customers')
-        match = df[df['CustomerID'] == customer_id]
-        if match.empty:
+        index = self._get_derived('ref_customers', 'by_id',
+                                  lambda: self._position_index(df['CustomerID']))
+        pos = index.get(customer_id)
+        if pos is None:
             return None
-        return match.iloc[0].where(pd.notnull(match.iloc[0]), None).to_dict()
+        return self._sanitize_for_json(df.iloc[pos:pos + 1])[0]
     
     def search_customers(self, query: str, limit: int = 10) -> List[Dict]:
         """Search customers by name or account number."""
         individual_df = self._get_reference_sheet('individual_customers')
         store_df = self._get_reference_sheet('store_customers')
         
-        results = []
-        
-        # Search individual customers
-        mask = (
-            individual_df['FirstName'].str.contains(query, case=False, na=False) |
-            individual_df['LastName'].str.contains(query, case=False, na=False)
-        )
-        matches = individual_df[mask].head(limit)
-        for _, row in matches.iterrows():
-            results.append({
-                'type': 'individual',
-                'name': f"{row['FirstName']} {row['LastName']}",
-                'business_entity_id': row['BusinessEntityID']
-            })
-        
-        # Search store customers
-        mask = store_df['Name'].str.contains(query, case=False, na=False)
-        matches = store_df[mask].head(limit - len(results))
-        for _, row in matches.iterrows():
-            results.append({
-                'type': 'store',
-                'name': row['Name'],
-                'business_entity_id': row['BusinessEntityID']
-            })
-        
-        return results[:limit]
+        index = self._get_derived(('ref_individual_customers', 'ref_store_customers'), 'customer_search',
+                                  lambda: self._build_customer_search_index(individual_df, store_df))
+        
+        # Plain substring match over all customers in one vectorized scan
+        # (individuals come first, so they keep priority within the limit)
+        hits = np.flatnonzero(np.char.find(index['search_text'], query.lower()) >= 0)[:limit]
+        
+        return [
+            {
+                'type': index['type'][i],
+                'name': index['name'][i],
+                'business_entity_id': index['business_entity_id'][i]
+            }
+            for i in hits
+        ]
+    
+    def _build_customer_search_index(self, individual_df: pd.DataFrame, store_df: pd.DataFrame) -> Dict[str, Any]:
+        """
+        Parallel columns over individual and store customers for search_customers.
+        Individuals are searchable by first or last name: the two are joined with a
+        newline so a query can't match across them.
+        """
+        first_names = individual_df['FirstName'].astype(object)
+        last_names = individual_df['LastName'].astype(object)
+        store_names = store_df['Name'].astype(object)
+        
+        search_text = pd.concat([
+            first_names.fillna('').astype(str) + '\n' + last_names.fillna('').astype(str),
+            store_names
+        ], ignore_index=True)
+        
+        return {
+            'search_text': self._lowercase_array(search_text),
+            'type': ['individual'] * len(individual_df) + ['store'] * len(store_df),
+            'name': (first_names.astype(str) + ' ' + last_names.astype(str)).tolist() + store_names.tolist(),
+            'business_entity_id': individual_df['BusinessEntityID'].tolist() + store_df['BusinessEntityID'].tolist()
+        }
     
     # =========================================================================
-    # Write Operations (to Extracted_Orders.xlsx only)
+    # Write Operations (to Extracted_Orders.sqlite only)
     # =========================================================================
     
     def add_order(self, order_data: Dict) -> int:
         """
-        Add a new order to Extracted_Orders.xlsx.
+        Add a new order to Extracted_Orders.sqlite.
         
         Args:
             order_data: Order data dict
@@ -298,40 +636,17 @@ class Database:
         Returns:
             New SalesOrderID
         """
-        # Get max ID from extracted file (always available)
-        ext_df = self._get_extracted_sheet('extracted_orders', force_refresh=True)
-        ext_max = int(ext_df['SalesOrderID'].max()) if not ext_df.empty and not ext_df['SalesOrderID'].isna().all() else 0
-        
-        # Try to get max from reference file (may not exist)
-        try:
-            ref_df = self._get_reference_sheet('orders')
-            ref_max = int(ref_df['SalesOrderID'].max()) if not ref_df.empty else 0
-        except FileNotFoundError:
-            # Reference file doesn't exist, use default starting ID
-            ref_max = 75000  # Start from a high number to avoid conflicts
+        ref_max = self._reference_max_id('orders', 'SalesOrderID', 75000)
+        new_id = self._write(lambda conn: self._insert_order(conn, order_data, ref_max))
         
-        new_id = max(ref_max, ext_max) + 1
-        order_data['SalesOrderID'] = new_id
-        
-        # Generate SalesOrderNumber
-        if 'SalesOrderNumber' not in order_data:
-            order_data['SalesOrderNumber'] = f"EXT-{new_id}"
+        self._invalidate_extracted('extracted_orders')
         
-        # Add extraction metadata
-        order_data['ExtractedAt'] = datetime.now().isoformat()
-        
-        # Add new row
-        new_df = pd.concat([ext_df, pd.DataFrame([order_data])], ignore_index=True)
-        
-        # Save to extracted file
-        self._save_extracted_sheet('extracted_orders', new_df)
-        
-        logger.info(f"Added order {new_id} to Extracted_Orders.xlsx")
+        logger.info(f"Added order {new_id} to Extracted_Orders.sqlite")
         return new_id
     
     def add_order_details(self, order_id: int, line_items: List[Dict]) -> List[int]:
         """
-        Add order details to Extracted_Orders.xlsx.
+        Add order details to Extracted_Orders.sqlite.
         
         Args:
             order_id: The SalesOrderID
@@ -340,52 +655,175 @@ class Database:
         Returns:
             List of new SalesOrderDetailIDs
         """
-        # Get max detail ID from extracted file (always available)
-        ext_df = self._get_extracted_sheet('extracted_details', force_refresh=True)
-        ext_max = int(ext_df['SalesOrderDetailID'].max()) if not ext_df.empty and not ext_df['SalesOrderDetailID'].isna().all() else 0
+        ref_max = self._reference_max_id('order_details', 'SalesOrderDetailID', 120000)
+        new_ids = self._write(lambda conn: self._insert_details(conn, order_id, line_items, ref_max))
+        
+        self._invalidate_extracted('extracted_details')
         
-        # Try to get max from reference file (may not exist)
+        logger.info(f"Added {len(new_ids)} line items for order {order_id}")
+        return new_ids
+    
+    def add_order_with_details(self, order_data: Dict, line_items: List[Dict]) -> tuple[int, List[int]]:
+        """
+        Add an order and its line items to Extracted_Orders.sqlite in one transaction.
+        Either both are saved or neither is.
+        
+        Args:
+            order_data: Order data dict
+            line_items: List of line item dicts
+        
+        Returns:
+            Tuple of (new SalesOrderID, list of new SalesOrderDetailIDs)
+        """
+        return self.add_orders_with_details([(order_data, line_items)])[0]
+    
+    def add_orders_with_details(self, orders: List[tuple[Dict, List[Dict]]]) -> List[tuple[int, List[int]]]:
+        """
+        Add several orders and their line items in one transaction, with one
+        multi-row INSERT per table (see _insert_rows).
+        
+        Args:
+            orders: (order data dict, list of line item dicts) pairs
+        
+        Returns:
+            (new SalesOrderID, list of new SalesOrderDetailIDs) for each order, in input order
+        """
+        results = self._write_orders(orders)
+        self._orders_written(results)
+        return results
+    
+    def _write_orders(self, orders: List[tuple[Dict, List[Dict]]]) -> List[tuple[int, List[int]]]:
+        """Assign IDs to the orders and line items and insert them in one transaction."""
+        order_ref_max = self._reference_max_id('orders', 'SalesOrderID', 75000)
+        detail_ref_max = self._reference_max_id('order_details', 'SalesOrderDetailID', 120000)
+        
+        def insert(conn: sqlite3.Connection) -> List[tuple[int, List[int]]]:
+            order_id = self._next_id(conn, 'extracted_orders', 'SalesOrderID', order_ref_max)
+            detail_id = self._next_id(conn, 'extracted_details', 'SalesOrderDetailID', detail_ref_max)
+            
+            order_rows, detail_rows, results = [], [], []
+            for order_data, line_items in orders:
+                self._stamp_order(order_data, order_id)
+                detail_ids = list(range(detail_id, detail_id + len(line_items)))
+                for item, item_id in zip(line_items, detail_ids):
+                    item['SalesOrderID'] = order_id
+                    item['SalesOrderDetailID'] = item_id
+                
+                order_rows.append(order_data)
+                detail_rows.extend(line_items)
+                results.append((order_id, detail_ids))
+                order_id += 1
+                detail_id += len(line_items)
+            
+            self._insert_rows(conn, 'extracted_orders', order_rows)
+            self._insert_rows(conn, 'extracted_details', detail_rows)
+            return results
+        
+        return self._write(insert)
+    
+    def _orders_written(self, results: List[tuple[int, List[int]]]):
+        """Refresh caches after _write_orders has committed."""
+        self._invalidate_extracted('extracted_orders')
+        self._invalidate_extracted('extracted_details')
+        
+        line_items = sum(len(detail_ids) for _, detail_ids in results)
+        logger.info(f"Added {len(results)} order(s) with {line_items} line items to Extracted_Orders.sqlite")
+    
+    def _write(self, work):
+        """
+        Run work(conn) in a BEGIN IMMEDIATE transaction and return its result.
+        IMMEDIATE takes the write lock up front so concurrent workers can't issue the same ID.
+        The transaction runs through _run_blocking, so under gevent waiting for the
+        lock doesn't stall the worker.
+        """
+        def transaction():
+            with closing(self._connect()) as conn, conn:
+                conn.execute('BEGIN IMMEDIATE')
+                return work(conn)
+        
+        return _run_blocking(transaction)
+    
+    def _reference_max_id(self, sheet_key: str, id_column: str, default: int) -> int:
+        """
+        Highest ID in a reference sheet, or a default start when the reference file is missing.
+        Computed once per sheet load; the extracted side's max comes from SQLite in _next_id.
+        """
         try:
-            ref_df = self._get_reference_sheet('order_details')
-            ref_max = int(ref_df['SalesOrderDetailID'].max()) if not ref_df.empty else 0
+            ref_df = self._get_reference_sheet(sheet_key)
+            return self._get_derived(
+                f"ref_{sheet_key}", f"max_{id_column}",
+                lambda: int(ref_df[id_column].max()) if not ref_df.empty else 0
+            )
         except FileNotFoundError:
-            # Reference file doesn't exist, use default starting ID
-            ref_max = 120000  # Start from a high number to avoid conflicts
-        
-        max_id = max(ref_max, ext_max)
-        new_ids = []
+            # Reference file doesn't exist, start from a high number to avoid conflicts
+            return default
+    
+    def _insert_order(self, conn: sqlite3.Connection, order_data: Dict, ref_max: int) -> int:
+        """Assign the next SalesOrderID and insert the order; the caller holds the write lock."""
+        new_id = self._next_id(conn, 'extracted_orders', 'SalesOrderID', ref_max)
+        self._stamp_order(order_data, new_id)
+        self._insert_rows(conn, 'extracted_orders', [order_data])
+        return new_id
+    
+    @staticmethod
+    def _stamp_order(order_data: Dict, order_id: int):
+        """Fill in the ID, default order number and extraction timestamp of a new order."""
+        order_data['SalesOrderID'] = order_id
         
-        new_rows = []
-        for item in line_items:
-            max_id += 1
-            item['SalesOrderID'] = order_id
-            item['SalesOrderDetailID'] = max_id
-            new_rows.append(item)
-            new_ids.append(max_id)
+        # Generate SalesOrderNumber
+        if 'SalesOrderNumber' not in order_data:
+            order_data['SalesOrderNumber'] = f"EXT-{order_id}"
         
-        new_df = pd.concat([ext_df, pd.DataFrame(new_rows)], ignore_index=True)
+        # Add extraction metadata
+        order_data['ExtractedAt'] = datetime.now().isoformat()
+    
+    def _insert_details(self, conn: sqlite3.Connection, order_id: int,
+                        line_items: List[Dict], ref_max: int) -> List[int]:
+        """Assign sequential SalesOrderDetailIDs and insert the line items; the caller holds the write lock."""
+        first_id = self._next_id(conn, 'extracted_details', 'SalesOrderDetailID', ref_max)
+        new_ids = list(range(first_id, first_id + len(line_items)))
         
-        self._save_extracted_sheet('extracted_details', new_df)
+        for item, detail_id in zip(line_items, new_ids):
+            item['SalesOrderID'] = order_id
+            item['SalesOrderDetailID'] = detail_id
         
-        logger.info(f"Added {len(new_ids)} line items for order {order_id}")
+        self._insert_rows(conn, 'extracted_details', line_items)
         return new_ids
     
-    def _save_extracted_sheet(self, sheet_key: str, df: pd.DataFrame):
-        """Save a DataFrame to the extracted orders file."""
-        # Load both sheets
-        orders_df = self._get_extracted_sheet('extracted_orders') if sheet_key != 'extracted_orders' else df
-        details_df = self._get_extracted_sheet('extracted_details') if sheet_key != 'extracted_details' else df
-        
-        # Write both sheets
-        with pd.ExcelWriter(self.extracted_path, engine='openpyxl') as writer:
-            orders_df.to_excel(writer, sheet_name='ExtractedOrders', index=False)
-            details_df.to_excel(writer, sheet_name='ExtractedOrderDetails', index=False)
+    def _next_id(self, conn: sqlite3.Connection, table_key: str, id_column: str, floor: int) -> int:
+        """Next free ID in an extracted table, kept above the reference data's ID range."""
+        table = self.EXTRACTED_TABLES[table_key]
+        # MAX over the INTEGER PRIMARY KEY is answered from the rowid b-tree, not a table scan
+        (current_max,) = conn.execute(f'SELECT MAX("{id_column}") FROM "{table}"').fetchone()
+        return max(floor, current_max or 0) + 1
+    
+    def _insert_rows(self, conn: sqlite3.Connection, table_key: str, rows: List[Dict]):
+        """
+        Insert rows into an extracted table; keys outside the table schema are ignored.
+        Rows go out as multi-row INSERT ... VALUES statements, as many per statement as
+        SQLite's bound-parameter limit allows, so a typical invoice is one statement.
+        """
+        if not rows:
+            return
         
-        # Update cache
-        self._cache[f"ext_{sheet_key}"] = df
-        self._cache_time[f"ext_{sheet_key}"] = datetime.now().timestamp()
+        columns = list(self.EXTRACTED_COLUMNS[table_key])
+        column_list = ', '.join(f'"{name}"' for name in columns)
+        row_placeholder = f"({', '.join('?' for _ in columns)})"
+        rows_per_statement = max(1, self.SQLITE_MAX_VARIABLES // len(columns))
         
-        logger.info(f"Saved to Extracted_Orders.xlsx")
+        for start in range(0, len(rows), rows_per_statement):
+            chunk = rows[start:start + rows_per_statement]
+            conn.execute(
+                f'INSERT INTO "{self.EXTRACTED_TABLES[table_key]}" ({column_list}) '
+                f'VALUES {", ".join([row_placeholder] * len(chunk))}',
+                [row.get(name) for row in chunk for name in columns]
+            )
+    
+    def _invalidate_extracted(self, table_key: str):
+        """Drop a cached extracted table so the next read picks up new rows."""
+        self._cache.pop(f"ext_{table_key}", None)
+        self._cache_time.pop(f"ext_{table_key}", None)
+        self._drop_derived(f"ext_{table_key}")
     
     # =========================================================================
     # Statistics
@@ -400,8 +838,8 @@ class Database:
         # Only load extracted data when extracted_only is True
         if extracted_only:
             try:
-                ext_orders = len(self._get_extracted_sheet('extracted_orders'))
-                ext_details = len(self._get_extracted_sheet('extracted_details'))
+                ext_orders = len(self._get_extracted_table('extracted_orders'))
+                ext_details = len(self._get_extracted_table('extracted_details'))
             except Exception:
                 ext_orders = 0
                 ext_details = 0
@@ -430,8 +868,8 @@ class Database:
             customers = 0
         
         try:
-            ext_orders = len(self._get_extracted_sheet('extracted_orders'))
-            ext_details = len(self._get_extracted_sheet('extracted_details'))
+            ext_orders = len(self._get_extracted_table('extracted_orders'))
+            ext_details = len(self._get_extracted_table('extracted_details'))
         except Exception:
             ext_orders = 0
             ext_details = 0
@@ -452,7 +890,7 @@ class Database:
     
     def get_extracted_orders(self, page: int = 1, per_page: int = 20) -> tuple[List[Dict], int]:
         """Get only extracted orders (for demo purposes)."""
-        df = self._get_extracted_sheet('extracted_orders')
+        df = self._get_extracted_table('extracted_orders')
         total = len(df)
         
         df = df.sort_values('SalesOrderID', ascending=False)
@@ -461,8 +899,157 @@ class Database:
         end = start + per_page
         page_df = df.iloc[start:end]
         
-        orders = page_df.where(pd.notnull(page_df), None).to_dict('records')
-        return orders, total
+        return self._sanitize_for_json(page_df), total
+
+
+def _run_blocking(fn):
+    """
+    Call fn() on a native thread when gevent has monkey-patched threading (the
+    gunicorn gevent worker, see gunicorn.conf.py), otherwise directly.
+    sqlite3 waits for a locked database in C, for up to the connection timeout,
+    which under gevent would block every greenlet in the worker.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return fn()
+    if not monkey.is_module_patched('threading'):
+        return fn()
+    
+    import gevent
+    return gevent.get_hub().threadpool.apply(fn)
+
+
+def _thread_pool(max_workers: int):
+    """
+    Executor backed by native threads even when gevent has patched threading.
+    A patched concurrent.futures.ThreadPoolExecutor runs its workers as greenlets,
+    which would parse CPU-bound sheets one after another instead of in parallel.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return ThreadPoolExecutor(max_workers=max_workers)
+    if not monkey.is_module_patched('threading'):
+        return ThreadPoolExecutor(max_workers=max_workers)
+    
+    from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+    return NativeThreadPoolExecutor(max_workers=max_workers)
+
+
+class BatchWriter:
+    """
+    Coalesces order saves from concurrent requests into shared transactions.
+    - A background thread writes every save queued while the previous write was
+      running in one Database transaction; saves that arrive while the thread
+      is idle are written immediately unless max_delay is set
+    - Each caller blocks until its own rows are committed, or up to timeout seconds
+    - If a combined write fails, its orders are retried one by one so a bad
+      order only fails its own request
+    """
+    
+    def __init__(self, database: Database, max_delay: float = 0.0, max_rows: int = 500, timeout: float = 60.0):
+        """
+        Args:
+            database: Database that performs the writes
+            max_delay: Seconds the first queued save waits for others to join its batch
+            max_rows: Order plus line item rows that end a batch early
+            timeout: Seconds submit waits for a save that hasn't started writing
+        """
+        self.database = database
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def submit(self, order_data: Dict, line_items: List[Dict]) -> tuple[int, List[int]]:
+        """
+        Save an order and its line items as part of the next batch.
+        
+        Returns:
+            Tuple of (new SalesOrderID, list of new SalesOrderDetailIDs)
+        
+        Raises:
+            TimeoutError: If the save didn't start within timeout seconds; it is then not written
+        """
+        future = Future()
+        self._get_queue().put((order_data, line_items, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except FuturesTimeoutError:
+            if future.cancel():
+                raise TimeoutError(f"Order save not started within {self.timeout}s") from None
+        # Already being written; the transaction is bounded by SQLite's busy timeout
+        return future.result()
+    
+    def _get_queue(self) -> queue.SimpleQueue:
+        """Queue served by this process's flusher thread, started on first use."""
+        pid = os.getpid()
+        # Threads don't survive fork, so a preloaded master's writer is restarted in each worker
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._queue = queue.SimpleQueue()
+                    threading.Thread(
+                        target=self._run, args=(self._queue,), name='db-batch-writer', daemon=True
+                    ).start()
+                    self._pid = pid
+        return self._queue
+    
+    def _run(self, jobs: queue.SimpleQueue):
+        while True:
+            batch = self._collect(jobs)
+            try:
+                self._flush(batch)
+            except Exception as e:
+                # Keep the thread alive: later saves in this process depend on it
+                logger.exception(f"Batch writer failed on {len(batch)} orders")
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+    
+    def _collect(self, jobs: queue.SimpleQueue) -> List[tuple]:
+        """Take the next batch: the first waiting save plus those queued behind it."""
+        batch, rows = [], 0
+        deadline = None
+        while rows < self.max_rows:
+            if not batch:
+                job = jobs.get()
+                deadline = time.monotonic() + self.max_delay
+            else:
+                remaining = deadline - time.monotonic()
+                try:
+                    job = jobs.get(timeout=remaining) if remaining > 0 else jobs.get_nowait()
+                except queue.Empty:
+                    break
+            # Skips saves whose caller gave up (submit cancels them on timeout)
+            if job[2].set_running_or_notify_cancel():
+                batch.append(job)
+                rows += 1 + len(job[1])
+        return batch
+    
+    def _flush(self, batch: List[tuple]):
+        try:
+            results = self.database._write_orders([(order, items) for order, items, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+                return
+            logger.warning(f"Batched save of {len(batch)} orders failed ({e}); retrying individually")
+            for job in batch:
+                self._flush([job])
+            return
+        
+        # Committed: a failure from here on must not write the orders again
+        try:
+            self.database._orders_written(results)
+        except Exception:
+            logger.exception(f"Could not refresh caches after saving {len(batch)} orders")
+        
+        for (_, _, future), result in zip(batch, results):
+            future.set_result(result)
 
 
 # Global database instance
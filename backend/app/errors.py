@@ -14,12 +14,13 @@ import traceback
 class APIError(Exception):
     """Base exception for API errors."""
     
-    def __init__(self, message: str, code: str, status_code: int = 400, details: dict = None):
+    def __init__(self, message: str, code: str, status_code: int = 400, details: dict = None, headers: dict = None):
         super().__init__(message)
         self.message = message
         self.code = code
         self.status_code = status_code
         self.details = details or {}
+        self.headers = headers or {}
 
 
 class ValidationError(APIError):
@@ -85,6 +86,19 @@ class ExtractionError(APIError):
         )
 
 
+class ServiceUnavailableError(APIError):
+    """Raised when the server is at capacity and sheds a request."""
+    
+    def __init__(self, message: str, retry_after: int = 5):
+        super().__init__(
+            message=message,
+            code="ERR_OVERLOADED",
+            status_code=503,
+            details={"retry_after": retry_after},
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
 class FileTypeError(APIError):
     """Raised when file type is not supported."""
     
@@ -115,7 +129,7 @@ def register_error_handlers(app):
                 "details": error.details
             }
         }
-        return jsonify(response), error.status_code
+        return jsonify(response), error.status_code, error.headers
     
     @app.errorhandler(400)
     def handle_bad_request(error):
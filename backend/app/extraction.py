@@ -2,22 +2,73 @@
 LLM-powered invoice extraction service.
 Supports OpenAI GPT-4o Vision and Google Gemini 2.0 Flash with automatic fallback.
 """
+import io
 import os
-import base64
 import json
+import hashlib
 import logging
-from typing import Optional, Dict, Any
-from dataclasses import dataclass
+import threading
+import time
+import orjson
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial
+from typing import Optional, List, Dict, Any
+from dataclasses import asdict, dataclass, field
 from abc import ABC, abstractmethod
 
+from pydantic import BaseModel, Field, ValidationError as PydanticValidationError, field_validator
+
+from app.cache import ExtractionCache, SemanticCache, DEFAULT_CACHE_DIR
+from app.errors import ServiceUnavailableError
+
 logger = logging.getLogger(__name__)
 
+# SIMD base64 codec when available; the stdlib encoder is the portable fallback
+try:
+    from pybase64 import b64encode_as_string
+except ImportError:
+    import base64
+
+    def b64encode_as_string(data: bytes) -> str:
+        return base64.b64encode(data).decode("ascii")
+
+# Markdown code fence that LLMs wrap around their JSON output
+_CODE_FENCE = '```'
+
+
+def _strip_code_fence(text: str) -> str:
+    """
+    Remove a surrounding ```/```json fence from LLM output.
+    Plain string ops: only the ends are touched, where a regex would scan the whole payload.
+    """
+    text = text.strip()
+    if text.startswith(_CODE_FENCE):
+        text = text[len(_CODE_FENCE):]
+        if text.startswith('json'):
+            text = text[len('json'):]
+    if text.endswith(_CODE_FENCE):
+        text = text[:-len(_CODE_FENCE)]
+    return text
+
+
+def _outer_json_object(text: str) -> Optional[str]:
+    """
+    Slice from the first '{' to the last '}', dropping prose the model wrapped around its JSON.
+    Two C-level scans (str.find/str.rfind) from opposite ends; None if there is no object.
+    """
+    start = text.find('{')
+    end = text.rfind('}')
+    if start == -1 or end < start:
+        return None
+    return text[start:end + 1]
+
 
 # =============================================================================
 # Data Classes
 # =============================================================================
 
-@dataclass
+@dataclass(slots=True)
 class ExtractionResult:
     """Result from invoice extraction."""
     success: bool
@@ -28,7 +79,27 @@ class ExtractionResult:
     raw_response: Optional[str] = None
 
 
-@dataclass
+@dataclass(slots=True)
+class ImageEnvelope:
+    """
+    Invoice image handed to providers.
+    data is bytes, or a read-only view or mmap of the upload. Providers that accept raw
+    bytes use it directly; the base64 data URL is built on first use and shared
+    by every provider attempt.
+    """
+    data: bytes
+    mime_type: str = "image/png"
+    _data_url: Optional[str] = field(default=None, init=False, repr=False)
+    
+    @property
+    def data_url(self) -> str:
+        """Image as a base64 data: URL, for APIs that only take inline images."""
+        if self._data_url is None:
+            self._data_url = f"data:{self.mime_type};base64,{b64encode_as_string(self.data)}"
+        return self._data_url
+
+
+@dataclass(slots=True)
 class Address:
     """Parsed address structure."""
     name: str = ""
@@ -47,6 +118,88 @@ class Address:
         }
 
 
+# =============================================================================
+# Image Preprocessing
+# =============================================================================
+
+# Longest side sent to the LLM; GPT-4o high-detail vision gains nothing above ~2048px (0 disables)
+IMAGE_MAX_DIMENSION = int(os.getenv("IMAGE_MAX_DIMENSION", "2048"))
+IMAGE_JPEG_QUALITY = 85
+
+
+class UploadedImage:
+    """
+    Upload bytes plus a Pillow image opened from them at most once.
+    The semantic cache's perceptual hash and prepare_image's resize share the
+    opened image, so its pixels are decoded once per request. Opening only
+    parses the header; pixels are decoded by the first step that needs them.
+    """
+    
+    def __init__(self, data: bytes, mime_type: str):
+        self.data = data
+        self.mime_type = mime_type
+        self._image = None
+        self._opened = False
+    
+    @property
+    def image(self):
+        """Pillow image of the upload, or None for PDFs and data Pillow can't open."""
+        if not self._opened:
+            self._opened = True
+            if self.mime_type.startswith("image/"):
+                from PIL import Image
+                try:
+                    self._image = Image.open(io.BytesIO(self.data))
+                except Exception as e:
+                    logger.warning(f"Could not open uploaded image: {e}")
+        return self._image
+
+
+def prepare_image(upload: UploadedImage) -> tuple[bytes, str]:
+    """
+    Downscale oversized images before they are encoded and uploaded.
+    Images within IMAGE_MAX_DIMENSION, PDFs and anything Pillow can't decode are
+    returned unchanged; larger images are resized and re-encoded as JPEG.
+    
+    Args:
+        upload: Uploaded image bytes, MIME type and opened Pillow image
+    
+    Returns:
+        Tuple of (image bytes, MIME type) to send to the provider
+    """
+    image = upload.image if IMAGE_MAX_DIMENSION > 0 else None
+    if image is None or max(image.size) <= IMAGE_MAX_DIMENSION:
+        return upload.data, upload.mime_type
+    
+    from PIL import Image, ImageOps
+    
+    try:
+        original_size = image.size
+        # Phone photos carry their rotation in EXIF; apply it before the metadata is dropped.
+        # Returns a copy, so the shared upload image is left as decoded
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+        
+        if image.mode in ("RGBA", "LA", "P"):
+            # Flatten transparency onto white paper rather than letting it turn black
+            background = Image.new("RGB", image.size, "white")
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    except Exception as e:
+        logger.warning(f"Could not preprocess image, sending original: {e}")
+        return upload.data, upload.mime_type
+    
+    resized = output.getvalue()
+    logger.info(f"Downscaled image {original_size} -> {image.size}: {len(upload.data)} -> {len(resized)} bytes")
+    return resized, "image/jpeg"
+
+
 # =============================================================================
 # Prompt Templates
 # =============================================================================
@@ -100,14 +253,54 @@ CRITICAL - Tax Rate Precision:
 - "OTHER" should be read as the "other" field
 - If a value shows "-" or is blank, set it to 0.00"""
 
+BATCH_USER_PROMPT = f"""Each attached image is a separate invoice. Extract every invoice using the rules below, and return ONLY a JSON object of the form {{"invoices": [...]}} containing exactly one invoice object per image, in the same order as the images.
+
+{USER_PROMPT}"""
+
+# Single-text-part prompts for providers without a separate system role, joined once at import
+COMBINED_PROMPT = f"{SYSTEM_PROMPT}\n\n{USER_PROMPT}"
+COMBINED_BATCH_PROMPT = f"{SYSTEM_PROMPT}\n\n{BATCH_USER_PROMPT}"
+
+# Changes whenever the prompts are edited, so cached extractions from older prompts are not reused
+PROMPT_VERSION = hashlib.sha256(COMBINED_BATCH_PROMPT.encode()).hexdigest()[:12]
+
+# Output token budget per invoice; a batch request gets this much per image
+MAX_TOKENS_PER_INVOICE = 2000
+
+# Sent back to the model after an unparseable response, up to LLM_JSON_RETRIES times per call
+JSON_CORRECTION_PROMPT = "Your output failed to parse as JSON: {error}. Return the complete, valid JSON only."
+LLM_JSON_RETRIES = int(os.getenv("LLM_JSON_RETRIES", "2"))
+# Seconds to wait before corrective turn n (1-based) is this times n, easing off a struggling model
+LLM_JSON_RETRY_BACKOFF = float(os.getenv("LLM_JSON_RETRY_BACKOFF", "1.0"))
+
 
 # =============================================================================
 # LLM Provider Abstract Base Class
 # =============================================================================
 
+class ResponseParseError(Exception):
+    """Raised when a provider's response is still not valid JSON after corrective retries."""
+    
+    def __init__(self, raw_response: str, error: Exception):
+        super().__init__(str(error))
+        self.raw_response = raw_response
+        self.error = error
+
+
 class LLMProvider(ABC):
     """Abstract base class for LLM providers."""
     
+    # Shown in error messages, e.g. "OpenAI API key not configured"
+    label = "LLM"
+    
+    # Largest output the model accepts; bounds how many invoices fit in one batch request
+    max_output_tokens = MAX_TOKENS_PER_INVOICE
+    
+    @property
+    def max_batch_images(self) -> int:
+        """Most invoice images one batch request can extract."""
+        return max(1, self.max_output_tokens // MAX_TOKENS_PER_INVOICE)
+    
     @property
     @abstractmethod
     def name(self) -> str:
@@ -115,101 +308,37 @@ class LLMProvider(ABC):
         pass
     
     @abstractmethod
-    def extract_from_image(self, image_data: bytes, mime_type: str = "image/png") -> ExtractionResult:
+    def _request(self, images: List[ImageEnvelope], corrections: List[tuple[str, str]]) -> str:
         """
-        Extract invoice data from an image.
+        Send one extraction request and return the raw response text.
         
         Args:
-            image_data: Raw image bytes
-            mime_type: Image MIME type
-        
-        Returns:
-            ExtractionResult with extracted data or error
+            images: Invoice images; more than one uses BATCH_USER_PROMPT
+            corrections: (unparseable response, parse error) pairs from earlier
+                attempts, replayed as conversation turns so the model can fix its output
         """
         pass
     
-    def _parse_json_response(self, response_text: str) -> Dict:
-        """Parse JSON from LLM response, handling markdown code blocks."""
-        text = response_text.strip()
-        
-        # Remove markdown code blocks if present
-        if text.startswith("```json"):
-            text = text[7:]
-        elif text.startswith("```"):
-            text = text[3:]
+    def extract_from_image(self, image: ImageEnvelope) -> ExtractionResult:
+        """
+        Extract invoice data from an image.
         
-        if text.endswith("```"):
-            text = text[:-3]
+        Args:
+            image: Image bytes, MIME type and cached encodings
         
-        return json.loads(text.strip())
-
-
-# =============================================================================
-# OpenAI Provider
-# =============================================================================
-
-class OpenAIProvider(LLMProvider):
-    """OpenAI GPT-4o Vision provider."""
-    
-    def __init__(self, api_key: str = None):
-        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
-        self._client = None
-    
-    @property
-    def name(self) -> str:
-        return "openai"
-    
-    @property
-    def client(self):
-        if self._client is None:
-            try:
-                from openai import OpenAI
-                self._client = OpenAI(api_key=self.api_key)
-            except ImportError:
-                raise ImportError("openai package not installed. Run: pip install openai")
-        return self._client
-    
-    def extract_from_image(self, image_data: bytes, mime_type: str = "image/png") -> ExtractionResult:
+        Returns:
+            ExtractionResult with extracted data or error
+        """
         if not self.api_key:
             return ExtractionResult(
                 success=False,
                 confidence=0.0,
                 provider=self.name,
-                error="OpenAI API key not configured"
+                error=f"{self.label} API key not configured"
             )
         
         try:
-            # Encode image to base64
-            base64_image = base64.b64encode(image_data).decode("utf-8")
-            
-            # Make API call
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": USER_PROMPT},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{base64_image}",
-                                    "detail": "high"
-                                }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=2000,
-                temperature=0.1
-            )
-            
-            raw_response = response.choices[0].message.content
-            logger.info(f"OpenAI raw response: {raw_response[:200]}...")
-            
-            # Parse JSON response
-            extracted_data = self._parse_json_response(raw_response)
+            raw_response, extracted_data = self._request_json([image])
             confidence = extracted_data.get("confidence", 0.8)
             
             return ExtractionResult(
@@ -220,23 +349,210 @@ class OpenAIProvider(LLMProvider):
                 raw_response=raw_response
             )
             
-        except json.JSONDecodeError as e:
-            logger.error(f"OpenAI JSON parse error: {e}")
+        except ResponseParseError as e:
+            logger.error(f"{self.label} JSON parse error: {e.error}")
             return ExtractionResult(
                 success=False,
                 confidence=0.0,
                 provider=self.name,
-                error=f"Failed to parse JSON response: {str(e)}",
-                raw_response=raw_response if 'raw_response' in locals() else None
+                error=f"Failed to parse JSON response: {str(e.error)}",
+                raw_response=e.raw_response
             )
         except Exception as e:
-            logger.error(f"OpenAI extraction error: {e}")
+            logger.error(f"{self.label} extraction error: {e}")
             return ExtractionResult(
                 success=False,
                 confidence=0.0,
                 provider=self.name,
                 error=str(e)
             )
+    
+    def extract_from_images(self, images: List[ImageEnvelope]) -> List[ExtractionResult]:
+        """
+        Extract several invoices with a single API call.
+        
+        Args:
+            images: Up to max_batch_images invoice images
+        
+        Returns:
+            One ExtractionResult per image, in the same order; if the call or
+            response parsing fails, every result carries the same error. A response
+            with the wrong number of invoices is retried one image per request.
+        """
+        if len(images) == 1:
+            return [self.extract_from_image(images[0])]
+        
+        if not self.api_key:
+            error = f"{self.label} API key not configured"
+            return [ExtractionResult(success=False, confidence=0.0, provider=self.name, error=error) for _ in images]
+        
+        raw_response = None
+        try:
+            raw_response, invoices = self._request_json(images)
+            if isinstance(invoices, dict):
+                invoices = invoices.get("invoices")
+            if not isinstance(invoices, list) or len(invoices) != len(images):
+                # Results can't be mapped back to images by position, so ask for each one on its own
+                found = len(invoices) if isinstance(invoices, list) else 0
+                logger.warning(f"{self.label} batch returned {found} invoices for {len(images)} images; extracting them one at a time")
+                return [self.extract_from_image(image) for image in images]
+            
+            return [
+                ExtractionResult(
+                    success=True,
+                    confidence=invoice.get("confidence", 0.8),
+                    provider=self.name,
+                    data=invoice,
+                    raw_response=orjson.dumps(invoice).decode()
+                )
+                for invoice in invoices
+            ]
+        
+        except ResponseParseError as e:
+            logger.error(f"{self.label} batch JSON parse error: {e.error}")
+            error = f"Failed to parse JSON response: {str(e.error)}"
+            raw_response = e.raw_response
+        except Exception as e:
+            logger.error(f"{self.label} batch extraction error: {e}")
+            error = str(e)
+        
+        return [
+            ExtractionResult(success=False, confidence=0.0, provider=self.name, error=error, raw_response=raw_response)
+            for _ in images
+        ]
+    
+    def _request_json(self, images: List[ImageEnvelope]) -> tuple[str, Any]:
+        """
+        Request extraction JSON, sending parse errors back to the same model for up to
+        LLM_JSON_RETRIES corrective turns before giving up on this provider.
+        A corrective turn reuses the conversation, which is far cheaper than a full
+        failover to the other provider. Turn n waits LLM_JSON_RETRY_BACKOFF * n
+        seconds first. It keeps the full output budget, since the model re-emits
+        the whole JSON document rather than a fragment of it.
+        
+        Returns:
+            Tuple of (raw response text, parsed JSON)
+        
+        Raises:
+            ResponseParseError: If the last response still isn't valid JSON
+        """
+        corrections = []
+        while True:
+            raw_response = self._request(images, corrections)
+            logger.info(f"{self.label} raw response: {raw_response[:200]}...")
+            try:
+                return raw_response, self._parse_json_response(raw_response)
+            except json.JSONDecodeError as e:
+                if len(corrections) >= LLM_JSON_RETRIES:
+                    raise ResponseParseError(raw_response, e)
+                logger.warning(f"{self.label} returned invalid JSON ({e}); asking for a corrected response")
+                corrections.append((raw_response, str(e)))
+                time.sleep(LLM_JSON_RETRY_BACKOFF * len(corrections))
+    
+    def _parse_json_response(self, response_text: str) -> Dict:
+        """
+        Parse JSON from LLM response, handling markdown code blocks and
+        surrounding prose. The common case is a single orjson parse; only a
+        failed parse pays for locating the outer object.
+        Raises orjson.JSONDecodeError, a subclass of json.JSONDecodeError.
+        """
+        text = _strip_code_fence(response_text)
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            candidate = _outer_json_object(text)
+            if candidate is None or len(candidate) == len(text):
+                raise
+            return orjson.loads(candidate)
+    
+    def _max_tokens(self, images: List[ImageEnvelope]) -> int:
+        """Output budget for a request: one invoice's worth per image, capped at the model limit."""
+        return min(MAX_TOKENS_PER_INVOICE * len(images), self.max_output_tokens)
+
+
+# =============================================================================
+# OpenAI Provider
+# =============================================================================
+
+# Seconds before a single provider call is abandoned, bounding how long it holds a concurrency slot
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+def _get_http_client():
+    """
+    Process-wide httpx client for LLM API calls.
+    Keeps warm keep-alive connections (HTTP/2 when the h2 package is installed),
+    so calls after the first skip TCP and TLS setup.
+    """
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                import httpx
+                
+                limits = httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=60)
+                try:
+                    _http_client = httpx.Client(http2=True, limits=limits)
+                except ImportError:
+                    logger.info("h2 package not installed; using HTTP/1.1 keep-alive for LLM calls")
+                    _http_client = httpx.Client(limits=limits)
+    return _http_client
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI GPT-4o Vision provider."""
+    
+    label = "OpenAI"
+    model = "gpt-4o"
+    max_output_tokens = 16384
+    
+    def __init__(self, api_key: str = None):
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self._client = None
+        # Hedged and concurrent requests may build the client from several threads at once
+        self._client_lock = threading.Lock()
+    
+    @property
+    def name(self) -> str:
+        return "openai"
+    
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    try:
+                        from openai import OpenAI
+                        self._client = OpenAI(api_key=self.api_key, http_client=_get_http_client(), timeout=LLM_TIMEOUT)
+                    except ImportError:
+                        raise ImportError("openai package not installed. Run: pip install openai")
+        return self._client
+    
+    def _request(self, images: List[ImageEnvelope], corrections: List[tuple[str, str]]) -> str:
+        content = [{"type": "text", "text": BATCH_USER_PROMPT if len(images) > 1 else USER_PROMPT}]
+        content.extend(
+            {"type": "image_url", "image_url": {"url": image.data_url, "detail": "high"}}
+            for image in images
+        )
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": content}
+        ]
+        for bad_response, error in corrections:
+            messages.append({"role": "assistant", "content": bad_response})
+            messages.append({"role": "user", "content": JSON_CORRECTION_PROMPT.format(error=error)})
+        
+        # Make API call
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            max_tokens=self._max_tokens(images),
+            temperature=0.1
+        )
+        return response.choices[0].message.content
 
 
 # =============================================================================
@@ -246,9 +562,14 @@ class OpenAIProvider(LLMProvider):
 class GeminiProvider(LLMProvider):
     """Google Gemini 2.0 Flash provider."""
     
+    label = "Gemini"
+    model = "gemini-2.0-flash"
+    max_output_tokens = 8192
+    
     def __init__(self, api_key: str = None):
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
         self._client = None
+        self._client_lock = threading.Lock()
     
     @property
     def name(self) -> str:
@@ -256,78 +577,44 @@ class GeminiProvider(LLMProvider):
     
     def _get_model(self):
         if self._client is None:
-            try:
-                import google.generativeai as genai
-                genai.configure(api_key=self.api_key)
-                self._client = genai.GenerativeModel("gemini-2.0-flash")
-            except ImportError:
-                raise ImportError("google-generativeai package not installed. Run: pip install google-generativeai")
+            with self._client_lock:
+                if self._client is None:
+                    try:
+                        import google.generativeai as genai
+                        # REST rides on requests/urllib3 sockets, which gevent patches; the
+                        # default grpc transport blocks the whole worker while it waits
+                        genai.configure(api_key=self.api_key, transport='rest')
+                        self._client = genai.GenerativeModel(self.model)
+                    except ImportError:
+                        raise ImportError("google-generativeai package not installed. Run: pip install google-generativeai")
         return self._client
     
-    def extract_from_image(self, image_data: bytes, mime_type: str = "image/png") -> ExtractionResult:
-        if not self.api_key:
-            return ExtractionResult(
-                success=False,
-                confidence=0.0,
-                provider=self.name,
-                error="Gemini API key not configured"
-            )
+    def _request(self, images: List[ImageEnvelope], corrections: List[tuple[str, str]]) -> str:
+        import google.generativeai as genai
         
-        try:
-            import google.generativeai as genai
-            
-            model = self._get_model()
-            
-            # Create image part
-            image_part = {
-                "mime_type": mime_type,
-                "data": image_data
-            }
-            
-            # Make API call
-            response = model.generate_content(
-                [
-                    f"{SYSTEM_PROMPT}\n\n{USER_PROMPT}",
-                    image_part
-                ],
-                generation_config=genai.GenerationConfig(
-                    temperature=0.1,
-                    max_output_tokens=2000
-                )
-            )
-            
-            raw_response = response.text
-            logger.info(f"Gemini raw response: {raw_response[:200]}...")
-            
-            # Parse JSON response
-            extracted_data = self._parse_json_response(raw_response)
-            confidence = extracted_data.get("confidence", 0.8)
-            
-            return ExtractionResult(
-                success=True,
-                confidence=confidence,
-                provider=self.name,
-                data=extracted_data,
-                raw_response=raw_response
-            )
-            
-        except json.JSONDecodeError as e:
-            logger.error(f"Gemini JSON parse error: {e}")
-            return ExtractionResult(
-                success=False,
-                confidence=0.0,
-                provider=self.name,
-                error=f"Failed to parse JSON response: {str(e)}",
-                raw_response=raw_response if 'raw_response' in locals() else None
-            )
-        except Exception as e:
-            logger.error(f"Gemini extraction error: {e}")
-            return ExtractionResult(
-                success=False,
-                confidence=0.0,
-                provider=self.name,
-                error=str(e)
-            )
+        model = self._get_model()
+        
+        # Prompt followed by one inline part per image
+        parts = [COMBINED_BATCH_PROMPT if len(images) > 1 else COMBINED_PROMPT]
+        parts.extend({"mime_type": image.mime_type, "data": bytes(image.data)} for image in images)
+        
+        contents = parts
+        if corrections:
+            contents = [{"role": "user", "parts": parts}]
+            for bad_response, error in corrections:
+                contents.append({"role": "model", "parts": [bad_response]})
+                contents.append({"role": "user", "parts": [JSON_CORRECTION_PROMPT.format(error=error)]})
+        
+        # Make API call
+        response = model.generate_content(
+            contents,
+            generation_config=genai.GenerationConfig(
+                temperature=0.1,
+                max_output_tokens=self._max_tokens(images)
+            ),
+            request_options={"timeout": LLM_TIMEOUT}
+        )
+        return response.text
 
 
 # =============================================================================
@@ -339,42 +626,279 @@ class ExtractionService:
     Invoice extraction service with automatic provider failover.
     """
     
-    def __init__(self):
+    def __init__(self, cache_dir: str = None):
+        """
+        Args:
+            cache_dir: Directory for cached extraction results (default: EXTRACTION_CACHE_DIR
+                or data/extraction_cache; an empty string disables caching)
+        """
         self.providers = {
             "openai": OpenAIProvider(),
             "gemini": GeminiProvider()
         }
         self.primary = os.getenv("PRIMARY_LLM", "openai")
         self.fallback = "gemini" if self.primary == "openai" else "openai"
+        # Seconds to wait on the primary before also starting the fallback (0 disables hedging)
+        self.hedge_delay = float(os.getenv("LLM_HEDGE_DELAY", "10"))
+        # Invoices per LLM request in extract_invoice_batch (further capped by each provider)
+        self.batch_size = int(os.getenv("LLM_BATCH_SIZE", "4"))
+        
+        # Extractions allowed to call providers at once; past this, requests are shed
+        # with a 503 after admission_timeout seconds instead of queueing on the pool
+        self.max_concurrent = int(os.getenv("LLM_CONCURRENCY", "8"))
+        self.admission_timeout = float(os.getenv("LLM_ADMISSION_TIMEOUT", "0.1"))
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+        
+        # One thread per slot: a slot stays held until every call started under it has
+        # finished, so an admitted extraction never waits for a pool thread
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="llm")
+        
+        # Hedged fallback calls run on their own pool so they never queue behind slow
+        # primaries; when all hedge slots are busy, extractions just wait on the primary
+        self.max_hedges = int(os.getenv("LLM_MAX_HEDGES", str(max(1, self.max_concurrent // 4))))
+        self._hedge_slots = threading.BoundedSemaphore(self.max_hedges)
+        self._hedge_executor = ThreadPoolExecutor(max_workers=self.max_hedges, thread_name_prefix="llm-hedge")
+        # Hedges started, and calls whose result was discarded because the other provider won
+        self._hedges_started = 0
+        self._discarded_calls = 0
+        
+        if cache_dir is None:
+            cache_dir = os.getenv("EXTRACTION_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.cache = ExtractionCache(cache_dir, self._cache_namespace()) if cache_dir else None
+        
+        # Near-duplicate matching is opt-in: invoices sharing a template can hash alike
+        self.semantic_cache = None
+        if cache_dir and os.getenv("SEMANTIC_CACHE", "0") == "1":
+            try:
+                self.semantic_cache = SemanticCache(
+                    cache_dir, self._cache_namespace(),
+                    max_distance=int(os.getenv("SEMANTIC_CACHE_MAX_DISTANCE", "4"))
+                )
+            except ImportError as e:
+                logger.warning(f"Semantic cache disabled: {e}")
+    
+    def _cache_namespace(self) -> str:
+        """Prompt and model configuration that cached results depend on."""
+        primary, fallback = self.providers[self.primary], self.providers[self.fallback]
+        return f"{PROMPT_VERSION}|{primary.name}:{primary.model}|{fallback.name}:{fallback.model}"
     
     def extract_invoice(self, image_data: bytes, mime_type: str = "image/png") -> ExtractionResult:
         """
         Extract invoice data with automatic fallback.
+        Results for image bytes that were already extracted are served from the cache,
+        then (if enabled) results for perceptually near-identical images.
         
         Args:
             image_data: Raw image bytes
             mime_type: Image MIME type
         
         Returns:
-            ExtractionResult from primary or fallback provider
+            ExtractionResult from cache, primary or fallback provider
+        
+        Raises:
+            ServiceUnavailableError: If max_concurrent extractions are already calling providers
+        """
+        upload = UploadedImage(image_data, mime_type)
+        cached, cache_key, phash = self._lookup_cache(upload)
+        if cached is not None:
+            return cached
+        
+        # Shared by both attempts so the fallback reuses the primary's encoding work
+        image = ImageEnvelope(*prepare_image(upload))
+        with self._admit() as calls:
+            result = self._extract_with_failover(image, calls)
+        self._store_result(result, cache_key, phash, image_data, mime_type)
+        
+        return result
+    
+    def extract_invoice_batch(self, images: List[tuple[bytes, str]]) -> List[ExtractionResult]:
+        """
+        Extract several invoices, packing up to batch_size images into each LLM request.
+        Cached images are served from the cache; the rest are sent in concurrent batches,
+        each falling back to the secondary provider if the primary's batch call fails.
+        
+        Args:
+            images: (raw image bytes, MIME type) pairs
+        
+        Returns:
+            One ExtractionResult per image, in the same order
+        
+        Raises:
+            ServiceUnavailableError: If there is no capacity for the batch's LLM requests
+        """
+        results: List[Optional[ExtractionResult]] = [None] * len(images)
+        pending = []
+        for index, (image_data, mime_type) in enumerate(images):
+            upload = UploadedImage(image_data, mime_type)
+            cached, cache_key, phash = self._lookup_cache(upload)
+            if cached is not None:
+                results[index] = cached
+            else:
+                pending.append((index, cache_key, phash, ImageEnvelope(*prepare_image(upload))))
+        
+        size = max(1, min(
+            self.batch_size,
+            self.providers[self.primary].max_batch_images,
+            self.providers[self.fallback].max_batch_images
+        ))
+        chunks = [pending[start:start + size] for start in range(0, len(pending), size)]
+        logger.info(f"Batch extraction: {len(images)} images, {len(pending)} uncached, {len(chunks)} LLM requests")
+        if not chunks:
+            return results
+        
+        with self._admit(min(len(chunks), self.max_concurrent)) as calls:
+            futures = [
+                self._executor.submit(self._extract_batch_with_failover, [entry[3] for entry in chunk])
+                for chunk in chunks
+            ]
+            calls.extend(futures)
+            
+            for chunk, future in zip(chunks, futures):
+                for (index, cache_key, phash, _), result in zip(chunk, future.result()):
+                    image_data, mime_type = images[index]
+                    self._store_result(result, cache_key, phash, image_data, mime_type)
+                    results[index] = result
+        
+        return results
+    
+    @contextmanager
+    def _admit(self, slots: int = 1):
+        """
+        Hold concurrency slots while an extraction calls providers.
+        Yields a list for the futures of the provider calls made under the slots;
+        the slots are released once the block has exited and all of those calls
+        have finished, so a hedge loser still running on the pool keeps its slot.
+        
+        Raises:
+            ServiceUnavailableError: If a slot doesn't free up within admission_timeout
+        """
+        acquired = 0
+        try:
+            for _ in range(slots):
+                if not self._slots.acquire(timeout=self.admission_timeout):
+                    logger.warning(f"Shedding extraction: {self._in_flight}/{self.max_concurrent} LLM slots busy")
+                    raise ServiceUnavailableError("Extraction capacity exhausted, please retry shortly")
+                acquired += 1
+        except BaseException:
+            for _ in range(acquired):
+                self._slots.release()
+            raise
+        
+        with self._in_flight_lock:
+            self._in_flight += acquired
+        calls: List[Future] = []
+        try:
+            yield calls
+        finally:
+            self._release_when_done(acquired, calls)
+    
+    def _release_when_done(self, slots: int, calls: List[Future]):
+        """Release admitted slots once every future in calls has finished (now, if there are none)."""
+        if not calls:
+            self._release(slots)
+            return
+        
+        pending = [len(calls)]
+        lock = threading.Lock()
+        
+        def call_done(_):
+            with lock:
+                pending[0] -= 1
+                last = pending[0] == 0
+            if last:
+                self._release(slots)
+        
+        for future in calls:
+            # Runs immediately for futures that are already done
+            future.add_done_callback(call_done)
+    
+    def _release(self, slots: int):
+        with self._in_flight_lock:
+            self._in_flight -= slots
+        for _ in range(slots):
+            self._slots.release()
+    
+    def _lookup_cache(self, upload: UploadedImage) -> tuple[Optional[ExtractionResult], Optional[str], Optional[int]]:
+        """
+        Look an image up in the exact, then semantic cache.
+        
+        Returns:
+            Tuple of (cached result or None, exact cache key, perceptual hash)
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key_for(upload.data)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Extraction cache hit: {cache_key[:12]} (provider: {cached.get('provider')})")
+                return ExtractionResult(**cached), cache_key, None
+        
+        phash = None
+        if self.semantic_cache is not None:
+            phash = self.semantic_cache.image_hash(upload.image)
+            cached = self.semantic_cache.get(phash) if phash is not None else None
+            if cached is not None:
+                if cache_key is not None:
+                    self.cache.put(cache_key, cached, metadata={'semantic_match': f'{phash:016x}'})
+                return ExtractionResult(**cached), cache_key, phash
+        
+        return None, cache_key, phash
+    
+    def _store_result(self, result: ExtractionResult, cache_key: Optional[str], phash: Optional[int],
+                      image_data: bytes, mime_type: str):
+        """Cache a successful extraction under the keys found by _lookup_cache."""
+        if not result.success:
+            return
+        
+        fields = asdict(result)
+        if cache_key is not None:
+            provider = self.providers[result.provider]
+            self.cache.put(cache_key, fields, metadata={
+                'model': provider.model,
+                'mime_type': mime_type,
+                'size_bytes': len(image_data)
+            })
+        if phash is not None:
+            self.semantic_cache.put(phash, fields)
+    
+    def _extract_with_failover(self, image: ImageEnvelope, calls: List[Future]) -> ExtractionResult:
+        """
+        Run the primary provider, falling back to the secondary on failure.
+        If the primary is still running after hedge_delay seconds, the fallback
+        is started alongside it on the hedge pool (if a hedge slot is free) and
+        the first successful result wins.
+        Every provider call is added to calls, the admission lease from _admit.
         """
         # Try primary provider
         logger.info(f"Attempting extraction with primary provider: {self.primary}")
-        result = self.providers[self.primary].extract_from_image(image_data, mime_type)
+        futures = {self._submit(self.primary, image, calls): self.primary}
+        
+        done, _ = wait(futures, timeout=self._hedge_timeout())
+        if not done:
+            hedge = self._submit_hedge(image, calls)
+            if hedge is not None:
+                logger.warning(f"Primary provider still running after {self.hedge_delay}s. Hedging with: {self.fallback}")
+                futures[hedge] = self.fallback
+            else:
+                logger.warning(f"Primary provider still running after {self.hedge_delay}s; all {self.max_hedges} hedge slots busy")
         
-        if result.success:
-            logger.info(f"Primary extraction successful with confidence: {result.confidence}")
-            return result
+        winner, results = self._first_success(futures)
         
-        # Fallback to secondary provider
-        logger.warning(f"Primary provider failed: {result.error}. Trying fallback: {self.fallback}")
-        fallback_result = self.providers[self.fallback].extract_from_image(image_data, mime_type)
+        if winner is None and self.fallback not in results:
+            # Fallback to secondary provider
+            logger.warning(f"Primary provider failed: {results[self.primary].error}. Trying fallback: {self.fallback}")
+            winner, fallback_results = self._first_success({self._submit(self.fallback, image, calls): self.fallback})
+            results.update(fallback_results)
         
-        if fallback_result.success:
-            logger.info(f"Fallback extraction successful with confidence: {fallback_result.confidence}")
-            return fallback_result
+        if winner is not None:
+            stage = "Primary" if winner.provider == self.primary else "Fallback"
+            logger.info(f"{stage} extraction successful with confidence: {winner.confidence}")
+            return winner
         
         # Both failed
+        result, fallback_result = results[self.primary], results[self.fallback]
         logger.error(f"Both providers failed. Primary: {result.error}, Fallback: {fallback_result.error}")
         return ExtractionResult(
             success=False,
@@ -383,6 +907,83 @@ class ExtractionService:
             error=f"All providers failed. Primary ({self.primary}): {result.error}; Fallback ({self.fallback}): {fallback_result.error}"
         )
     
+    def _extract_batch_with_failover(self, images: List[ImageEnvelope]) -> List[ExtractionResult]:
+        """
+        Extract a batch with the primary provider, retrying the images it failed
+        on with the fallback. Batches are not hedged: a duplicate multi-image
+        request costs K invoices' worth of tokens.
+        """
+        results = self.providers[self.primary].extract_from_images(images)
+        failed = [index for index, result in enumerate(results) if not result.success]
+        if not failed:
+            return results
+        
+        logger.warning(f"Primary provider failed on {len(failed)} of {len(images)} batched images. Trying fallback: {self.fallback}")
+        fallback_results = self.providers[self.fallback].extract_from_images([images[index] for index in failed])
+        for index, fallback_result in zip(failed, fallback_results):
+            if fallback_result.success:
+                results[index] = fallback_result
+            else:
+                results[index] = ExtractionResult(
+                    success=False,
+                    confidence=0.0,
+                    provider="none",
+                    error=f"All providers failed. Primary ({self.primary}): {results[index].error}; Fallback ({self.fallback}): {fallback_result.error}"
+                )
+        return results
+    
+    def _submit(self, provider_name: str, image: ImageEnvelope, calls: List[Future]) -> Future:
+        """Run a provider's extraction on the shared worker pool, under the admission lease calls."""
+        future = self._executor.submit(self.providers[provider_name].extract_from_image, image)
+        calls.append(future)
+        return future
+    
+    def _submit_hedge(self, image: ImageEnvelope, calls: List[Future]) -> Optional[Future]:
+        """Start the fallback on the hedge pool, or return None if no hedge slot is free."""
+        if not self._hedge_slots.acquire(blocking=False):
+            return None
+        future = self._hedge_executor.submit(self.providers[self.fallback].extract_from_image, image)
+        future.add_done_callback(lambda _: self._hedge_slots.release())
+        with self._in_flight_lock:
+            self._hedges_started += 1
+        calls.append(future)
+        return future
+    
+    def _discard_loser(self, provider_name: str, future: Future):
+        """Account for a call that finished after the other provider's result was used."""
+        with self._in_flight_lock:
+            self._discarded_calls += 1
+        logger.info(f"Discarded {provider_name} result from a call that lost the hedge race (tokens still billed)")
+    
+    def _hedge_timeout(self) -> Optional[float]:
+        """How long to wait on the primary alone; None waits for it to finish."""
+        if self.hedge_delay <= 0 or not self.providers[self.fallback].api_key:
+            return None
+        return self.hedge_delay
+    
+    def _first_success(self, futures: Dict[Future, str]) -> tuple[Optional[ExtractionResult], Dict[str, ExtractionResult]]:
+        """
+        Wait on provider futures until one succeeds.
+        
+        Returns:
+            Tuple of (first successful result or None, results collected by provider name)
+        """
+        results = {}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                results[futures[future]] = result
+                if result.success:
+                    # A call already in flight can't be interrupted; it runs to completion
+                    # and is counted when its result is discarded
+                    for other in pending:
+                        if not other.cancel():
+                            other.add_done_callback(partial(self._discard_loser, futures[other]))
+                    return result, results
+        return None, results
+    
     def get_provider_status(self) -> Dict[str, Dict]:
         """Check status of configured providers."""
         status = {}
@@ -393,6 +994,56 @@ class ExtractionService:
                 "is_primary": name == self.primary
             }
         return status
+    
+    def get_load(self) -> Dict[str, int]:
+        """
+        Concurrency slots in use, for monitoring how close the service is to shedding,
+        and hedging counters, for the token cost of calls whose result went unused.
+        """
+        return {
+            "in_flight": self._in_flight,
+            "capacity": self.max_concurrent,
+            "hedges_started": self._hedges_started,
+            "discarded_calls": self._discarded_calls
+        }
+
+
+# =============================================================================
+# Validation Schemas
+# =============================================================================
+
+class HeaderSchema(BaseModel):
+    """Invoice header fields checked by validate_extraction."""
+    invoice_number: Any = None
+    date: Any = None
+
+
+class LineItemSchema(BaseModel):
+    """Line item amounts; numeric strings are coerced to numbers."""
+    quantity: Optional[float] = None
+    unit_price: Optional[float] = None
+    total: Optional[float] = None
+
+
+class TotalsSchema(BaseModel):
+    """Invoice totals checked by validate_extraction."""
+    total: Any = None
+
+
+class ExtractionSchema(BaseModel):
+    """
+    Shape of the LLM's extraction JSON, validated by pydantic-core in a single pass.
+    Only the fields validate_extraction checks are declared; others are ignored.
+    """
+    header: HeaderSchema = Field(default_factory=HeaderSchema)
+    line_items: Optional[List[LineItemSchema]] = None
+    totals: TotalsSchema = Field(default_factory=TotalsSchema)
+    
+    @field_validator("header", "totals", mode="before")
+    @classmethod
+    def _null_as_empty(cls, value):
+        # The LLM is told to use null for missing data, including whole sections
+        return {} if value is None else value
 
 
 # =============================================================================
@@ -402,6 +1053,8 @@ class ExtractionService:
 def validate_extraction(data: Dict) -> tuple[bool, list]:
     """
     Validate extracted invoice data.
+    Types are checked and numbers coerced by ExtractionSchema in one pass;
+    only the presence and line-math checks run in Python.
     
     Args:
         data: Extracted invoice data
@@ -409,38 +1062,60 @@ def validate_extraction(data: Dict) -> tuple[bool, list]:
     Returns:
         Tuple of (is_valid, list of issues)
     """
+    try:
+        extraction = ExtractionSchema.model_validate(data)
+    except PydanticValidationError as e:
+        issues = [_format_schema_error(error) for error in e.errors()]
+        return False, issues
+    
     issues = []
     
     # Check header
-    header = data.get("header", {})
-    if not header.get("invoice_number"):
+    header = extraction.header
+    if not header.invoice_number:
         issues.append("Missing invoice number")
-    if not header.get("date"):
+    if not header.date:
         issues.append("Missing invoice date")
     
     # Check line items
-    line_items = data.get("line_items", [])
+    line_items = extraction.line_items
     if not line_items:
         issues.append("No line items found")
     else:
         for i, item in enumerate(line_items):
-            qty = item.get("quantity", 0)
-            price = item.get("unit_price", 0)
-            total = item.get("total", 0)
+            qty = item.quantity or 0
+            price = item.unit_price or 0
+            total = item.total or 0
             
             # Validate math (with 1% tolerance for rounding)
             expected = qty * price
             if expected > 0 and abs(total - expected) / expected > 0.01:
-                issues.append(f"Line item {i+1}: math mismatch (qty={qty} × price={price} ≠ total={total})")
+                issues.append(
+                    f"Line item {i+1}: math mismatch "
+                    f"(qty={_plain(qty)} × price={_plain(price)} ≠ total={_plain(total)})"
+                )
     
     # Check totals
-    totals = data.get("totals", {})
-    if not totals.get("total"):
+    if not extraction.totals.total:
         issues.append("Missing total amount")
     
     return len(issues) == 0, issues
 
 
+def _plain(value: float):
+    """Show whole numbers without a trailing .0, as they appear in the extracted JSON."""
+    return int(value) if float(value).is_integer() else value
+
+
+def _format_schema_error(error: Dict) -> str:
+    """Turn a pydantic error into an issue message, e.g. 'Line item 2: quantity - Input should be a valid number'."""
+    loc = error["loc"]
+    if len(loc) >= 2 and loc[0] == "line_items" and isinstance(loc[1], int):
+        field_path = ".".join(str(part) for part in loc[2:]) or "item"
+        return f"Line item {loc[1] + 1}: {field_path} - {error['msg']}"
+    return f"{'.'.join(str(part) for part in loc) or 'data'} - {error['msg']}"
+
+
 def transform_to_sales_order(data: Dict, sales_order_id: int = None) -> tuple[Dict, list]:
     """
     Transform extracted data to SalesOrderHeader and SalesOrderDetail format.
@@ -489,5 +1164,17 @@ def transform_to_sales_order(data: Dict, sales_order_id: int = None) -> tuple[Di
     return order_header, order_details
 
 
-# Global service instance
-extraction_service = ExtractionService()
+# Global service instance, created on first use so processes that only serve
+# database routes never build providers, caches or the worker pool
+_extraction_service = None
+_extraction_service_lock = threading.Lock()
+
+
+def get_extraction_service() -> ExtractionService:
+    """Return the process-wide ExtractionService, creating it on first call."""
+    global _extraction_service
+    if _extraction_service is None:
+        with _extraction_service_lock:
+            if _extraction_service is None:
+                _extraction_service = ExtractionService()
+    return _extraction_service
@@ -2,24 +2,40 @@
 API Routes for Document Extraction Application.
 Provides endpoints for health check, database operations, and invoice extraction.
 """
-import json
+import time
+import hashlib
+import orjson
+from contextlib import ExitStack
 from flask import Blueprint, request, Response, stream_with_context
 
 # App imports
-from app.utils import success_response, paginated_response, track_response_time, validate_file_type, track_operation
+from app.utils import (
+    success_response, paginated_response, validate_file_type,
+    file_extension, track_operation, open_upload
+)
 from app.database import db
 from app.errors import NotFoundError, ValidationError, FileTypeError, ExtractionError
-from app.extraction import extraction_service, validate_extraction, transform_to_sales_order
+from app.extraction import get_extraction_service, validate_extraction, transform_to_sales_order
 
 api_bp = Blueprint('api', __name__)
 
+# Invoice file types accepted by the upload endpoints
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'pdf', 'webp'})
+_ALLOWED_EXTENSION_LIST = sorted(ALLOWED_EXTENSIONS)
+
+# Most files accepted by one /invoices/batch request
+MAX_BATCH_FILES = 20
+
+# Seconds /llm/status reuses provider configuration (load is always read fresh)
+LLM_STATUS_TTL = 5
+_llm_status_cache = {'expires': 0.0, 'value': None}
+
 
 # =============================================================================
 # Health Check
 # =============================================================================
 
 @api_bp.route('/health', methods=['GET'])
-@track_response_time
 def health_check():
     """
     Health check endpoint.
@@ -41,7 +57,6 @@ def health_check():
 # =============================================================================
 
 @api_bp.route('/database/orders', methods=['GET'])
-@track_response_time
 def get_orders():
     """
     Get sales orders with pagination.
@@ -67,7 +82,6 @@ def get_orders():
 
 
 @api_bp.route('/database/orders/<int:order_id>', methods=['GET'])
-@track_response_time
 def get_order(order_id: int):
     """
     Get a specific order with its details.
@@ -78,15 +92,7 @@ def get_order(order_id: int):
     Returns:
         Order header and line items
     """
-    orders, _ = db.get_orders(page=1, per_page=1)
-    
-    # Find the specific order
-    order = None
-    all_orders, _ = db.get_orders(page=1, per_page=50000)
-    for o in all_orders:
-        if o['SalesOrderID'] == order_id:
-            order = o
-            break
+    order = db.get_order_by_id(order_id)
     
     if not order:
         raise NotFoundError("Order", str(order_id))
@@ -106,7 +112,6 @@ def get_order(order_id: int):
 # =============================================================================
 
 @api_bp.route('/database/details', methods=['GET'])
-@track_response_time
 def get_order_details():
     """
     Get order details with optional order filter.
@@ -136,7 +141,6 @@ def get_order_details():
 # =============================================================================
 
 @api_bp.route('/database/products', methods=['GET'])
-@track_response_time
 def get_products():
     """
     Get products with pagination.
@@ -157,7 +161,6 @@ def get_products():
 
 
 @api_bp.route('/database/products/search', methods=['GET'])
-@track_response_time
 def search_product():
     """
     Search for a product by ProductNumber.
@@ -186,7 +189,6 @@ def search_product():
 # =============================================================================
 
 @api_bp.route('/database/customers/<int:customer_id>', methods=['GET'])
-@track_response_time
 def get_customer(customer_id: int):
     """
     Get customer by ID.
@@ -206,7 +208,6 @@ def get_customer(customer_id: int):
 
 
 @api_bp.route('/database/customers/search', methods=['GET'])
-@track_response_time
 def search_customers():
     """
     Search customers by name.
@@ -238,7 +239,6 @@ def search_customers():
 # =============================================================================
 
 @api_bp.route('/database/stats', methods=['GET'])
-@track_response_time
 def get_database_stats():
     """
     Get database statistics.
@@ -259,7 +259,6 @@ def get_database_stats():
 # =============================================================================
 
 @api_bp.route('/invoices/upload', methods=['POST'])
-@track_response_time
 def upload_invoice():
     """
     Upload and extract data from an invoice image.
@@ -280,20 +279,14 @@ def upload_invoice():
         raise ValidationError("No file selected", {"field": "file"})
     
     # Validate file type
-    allowed_extensions = {'png', 'jpg', 'jpeg', 'pdf', 'webp'}
-    if not validate_file_type(file.filename, allowed_extensions):
-        raise FileTypeError(
-            file.filename.rsplit('.', 1)[1] if '.' in file.filename else 'unknown',
-            list(allowed_extensions)
-        )
-    
-    # Read file data
-    image_data = file.read()
+    if not validate_file_type(file.filename, ALLOWED_EXTENSIONS):
+        raise FileTypeError(file_extension(file.filename) or 'unknown', _ALLOWED_EXTENSION_LIST)
+    
     mime_type = file.content_type or 'image/png'
     
     # Extract data using LLM
-    with track_operation("llm_extraction"):
-        result = extraction_service.extract_invoice(image_data, mime_type)
+    with track_operation("llm_extraction"), open_upload(file) as image_data:
+        result = get_extraction_service().extract_invoice(image_data, mime_type)
     
     if not result.success:
         raise ExtractionError(result.error, confidence=result.confidence)
@@ -308,8 +301,7 @@ def upload_invoice():
     if save_to_db and is_valid:
         with track_operation("database_save"):
             order_header, order_details = transform_to_sales_order(result.data)
-            saved_order_id = db.add_order(order_header)
-            db.add_order_details(saved_order_id, order_details)
+            saved_order_id, _ = db.writer.submit(order_header, order_details)
     
     return success_response(data={
         'extraction': {
@@ -330,7 +322,6 @@ def upload_invoice():
 
 
 @api_bp.route('/invoices/extract', methods=['POST'])
-@track_response_time
 def extract_invoice_data():
     """
     Extract data from invoice without saving (preview mode).
@@ -343,18 +334,13 @@ def extract_invoice_data():
     if file.filename == '':
         raise ValidationError("No file selected", {"field": "file"})
     
-    allowed_extensions = {'png', 'jpg', 'jpeg', 'pdf', 'webp'}
-    if not validate_file_type(file.filename, allowed_extensions):
-        raise FileTypeError(
-            file.filename.rsplit('.', 1)[1] if '.' in file.filename else 'unknown',
-            list(allowed_extensions)
-        )
+    if not validate_file_type(file.filename, ALLOWED_EXTENSIONS):
+        raise FileTypeError(file_extension(file.filename) or 'unknown', _ALLOWED_EXTENSION_LIST)
     
-    image_data = file.read()
     mime_type = file.content_type or 'image/png'
     
-    with track_operation("llm_extraction"):
-        result = extraction_service.extract_invoice(image_data, mime_type)
+    with track_operation("llm_extraction"), open_upload(file) as image_data:
+        result = get_extraction_service().extract_invoice(image_data, mime_type)
     
     if not result.success:
         raise ExtractionError(result.error, confidence=result.confidence)
@@ -372,6 +358,92 @@ def extract_invoice_data():
     })
 
 
+@api_bp.route('/invoices/batch', methods=['POST'])
+def extract_invoice_batch():
+    """
+    Extract data from several invoices without saving (preview mode).
+    Accepts multiple `file` or `file[]` form fields; images are packed into
+    shared LLM requests, and results are returned in upload order.
+    """
+    files = request.files.getlist('file') + request.files.getlist('file[]')
+    if not files:
+        raise ValidationError("No files uploaded", {"field": "file"})
+    if len(files) > MAX_BATCH_FILES:
+        raise ValidationError(f"Too many files: at most {MAX_BATCH_FILES} per batch", {"field": "file"})
+    
+    for file in files:
+        if file.filename == '':
+            raise ValidationError("No file selected", {"field": "file"})
+        if not validate_file_type(file.filename, ALLOWED_EXTENSIONS):
+            raise FileTypeError(file_extension(file.filename) or 'unknown', _ALLOWED_EXTENSION_LIST)
+    
+    with track_operation("llm_extraction"), ExitStack() as uploads:
+        images = [(uploads.enter_context(open_upload(file)), file.content_type or 'image/png') for file in files]
+        results = get_extraction_service().extract_invoice_batch(images)
+    
+    items = []
+    for file, result in zip(files, results):
+        item = {
+            'filename': file.filename,
+            'success': result.success,
+            'provider': result.provider,
+            'confidence': result.confidence
+        }
+        if result.success:
+            is_valid, issues = validate_extraction(result.data)
+            item['extracted_data'] = result.data
+            item['validation'] = {
+                'is_valid': is_valid,
+                'issues': issues
+            }
+        else:
+            item['error'] = result.error
+        items.append(item)
+    
+    return success_response(data={
+        'results': items,
+        'total': len(items),
+        'succeeded': sum(1 for item in items if item['success'])
+    })
+
+
+def _encode_step(step_id: str, status: str, message: str = None) -> bytes:
+    """Encode an SSE progress frame."""
+    data = {"step": step_id, "status": status}
+    if message:
+        data["message"] = message
+    return b"data: %b\n\n" % orjson.dumps(data)
+
+
+# Progress frames whose message never changes, encoded once at import
+_STEP_FRAMES = {
+    (step_id, status, message): _encode_step(step_id, status, message)
+    for step_id, status, message in (
+        ("validate", "active", "Validating file..."),
+        ("validate", "error", "No file uploaded"),
+        ("validate", "error", "No file selected"),
+        ("validate", "error", "Invalid file type"),
+        ("validate", "complete", "File validated"),
+        ("upload", "active", "Reading image data..."),
+        ("extract", "active", "Validating extracted data..."),
+        ("extract", "complete", "All validation checks passed"),
+        ("save", "active", "Saving to database..."),
+        ("save", "error", "Cannot save - validation failed"),
+    )
+}
+
+
+def _step_frame(step_id: str, status: str, message: str = None) -> bytes:
+    """
+    Encoded SSE progress frame. Fixed messages come from _STEP_FRAMES; per-request
+    messages (sizes, order IDs, errors) are encoded on demand.
+    """
+    frame = _STEP_FRAMES.get((step_id, status, message))
+    if frame is None:
+        frame = _encode_step(step_id, status, message)
+    return frame
+
+
 @api_bp.route('/invoices/upload-stream', methods=['POST'])
 def upload_invoice_stream():
     """
@@ -381,10 +453,7 @@ def upload_invoice_stream():
     """
     def generate():
         def send_step(step_id: str, status: str, message: str = None):
-            data = {"step": step_id, "status": status}
-            if message:
-                data["message"] = message
-            yield f"data: {json.dumps(data)}\n\n"
+            yield _step_frame(step_id, status, message)
         
         def send_result(success: bool, data: dict = None, error: dict = None):
             result = {"type": "result", "success": success}
@@ -392,7 +461,7 @@ def upload_invoice_stream():
                 result["data"] = data
             if error:
                 result["error"] = error
-            yield f"data: {json.dumps(result)}\n\n"
+            yield b"data: %b\n\n" % orjson.dumps(result)
         
         # Step 1: Validate file
         yield from send_step("validate", "active", "Validating file...")
@@ -408,8 +477,7 @@ def upload_invoice_stream():
             yield from send_result(False, error={"code": "ERR_VALIDATION", "message": "No file selected"})
             return
         
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'pdf', 'webp'}
-        if not validate_file_type(file.filename, allowed_extensions):
+        if not validate_file_type(file.filename, ALLOWED_EXTENSIONS):
             yield from send_step("validate", "error", "Invalid file type")
             yield from send_result(False, error={"code": "ERR_FILE_TYPE", "message": "Invalid file type"})
             return
@@ -418,24 +486,27 @@ def upload_invoice_stream():
         
         # Step 2: Upload/Read file
         yield from send_step("upload", "active", "Reading image data...")
-        image_data = file.read()
         mime_type = file.content_type or 'image/png'
-        yield from send_step("upload", "complete", f"Image loaded ({len(image_data)} bytes)")
         
-        # Step 3: AI Analysis
-        yield from send_step("analyze", "active", f"Analyzing with {extraction_service.primary.upper()}...")
-        
-        try:
-            result = extraction_service.extract_invoice(image_data, mime_type)
-        except Exception as e:
-            yield from send_step("analyze", "error", str(e))
-            yield from send_result(False, error={"code": "ERR_LLM_FAILED", "message": str(e)})
-            return
-        
-        if not result.success:
-            yield from send_step("analyze", "error", result.error)
-            yield from send_result(False, error={"code": "ERR_EXTRACTION", "message": result.error})
-            return
+        # The upload stays mapped (not copied) until extraction is done
+        with open_upload(file) as image_data:
+            yield from send_step("upload", "complete", f"Image loaded ({len(image_data)} bytes)")
+            
+            # Step 3: AI Analysis
+            extraction_service = get_extraction_service()
+            yield from send_step("analyze", "active", f"Analyzing with {extraction_service.primary.upper()}...")
+            
+            try:
+                result = extraction_service.extract_invoice(image_data, mime_type)
+            except Exception as e:
+                yield from send_step("analyze", "error", str(e))
+                yield from send_result(False, error={"code": "ERR_LLM_FAILED", "message": str(e)})
+                return
+            
+            if not result.success:
+                yield from send_step("analyze", "error", result.error)
+                yield from send_result(False, error={"code": "ERR_EXTRACTION", "message": result.error})
+                return
         
         yield from send_step("analyze", "complete", f"Extracted with {result.provider} ({result.confidence*100:.0f}% confidence)")
         
@@ -458,8 +529,7 @@ def upload_invoice_stream():
             if is_valid:
                 try:
                     order_header, order_details = transform_to_sales_order(result.data)
-                    saved_order_id = db.add_order(order_header)
-                    db.add_order_details(saved_order_id, order_details)
+                    saved_order_id, _ = db.writer.submit(order_header, order_details)
                     yield from send_step("save", "complete", f"Saved as Order #{saved_order_id}")
                 except Exception as e:
                     yield from send_step("save", "error", str(e))
@@ -500,25 +570,43 @@ def upload_invoice_stream():
 # =============================================================================
 
 @api_bp.route('/llm/status', methods=['GET'])
-@track_response_time
 def get_llm_status():
     """
     Get status of configured LLM providers.
     
     Returns:
-        Provider configuration status
+        Provider configuration status, with an ETag; 304 if the client's copy is current
     """
-    status = extraction_service.get_provider_status()
-    
-    return success_response(data={
-        'providers': status,
-        'primary': extraction_service.primary,
-        'fallback': extraction_service.fallback
-    })
+    extraction_service = get_extraction_service()
+    data = {**_cached_provider_status(), 'load': extraction_service.get_load()}
+    
+    etag = hashlib.blake2b(orjson.dumps(data), digest_size=8).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = success_response(data=data)
+    
+    # The payload includes live load, so clients must revalidate rather than reuse it
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
+def _cached_provider_status() -> dict:
+    """Provider configuration for /llm/status, recomputed at most every LLM_STATUS_TTL seconds."""
+    now = time.monotonic()
+    if _llm_status_cache['value'] is None or now >= _llm_status_cache['expires']:
+        extraction_service = get_extraction_service()
+        _llm_status_cache['value'] = {
+            'providers': extraction_service.get_provider_status(),
+            'primary': extraction_service.primary,
+            'fallback': extraction_service.fallback
+        }
+        _llm_status_cache['expires'] = now + LLM_STATUS_TTL
+    return _llm_status_cache['value']
 
 
 @api_bp.route('/invoices/save-edited', methods=['POST'])
-@track_response_time
 def save_edited_invoice():
     """
     Save edited invoice data to database.
@@ -535,8 +623,7 @@ def save_edited_invoice():
     # Transform to SalesOrder format and save
     with track_operation("save_edited"):
         order_header, order_details = transform_to_sales_order(extracted_data)
-        order_id = db.add_order(order_header)
-        db.add_order_details(order_id, order_details)
+        order_id, _ = db.writer.submit(order_header, order_details)
     
     return success_response(data={
         'saved': True,
@@ -0,0 +1,47 @@
+"""
+Gunicorn configuration for serving the API.
+
+Usage:
+    gunicorn -c gunicorn.conf.py
+
+Uses gevent workers: an extraction request spends seconds waiting on the LLM
+API, and under gevent that wait yields to other requests instead of pinning
+a worker thread, so one process serves many concurrent uploads.
+"""
+import os
+import multiprocessing
+
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gevent')
+
+if worker_class == 'gevent':
+    # Patch before the app is preloaded so locks, queues and sockets created at
+    # import time (LLM client locks, the provider thread pool) are cooperative.
+    # gunicorn has already imported threading by the time this file runs; that is
+    # safe because no threads have been started yet.
+    #
+    # Trade-offs of patching the whole app:
+    # - threading.Thread becomes a greenlet, so the BatchWriter flusher is a
+    #   greenlet; Database.warmup parses reference sheets on gevent's native
+    #   thread pool (database._thread_pool) so the preload still loads them in
+    #   parallel rather than one after another
+    # - sqlite3 is not cooperative: a write waiting on the database lock (up to
+    #   the 30s connection timeout under BEGIN IMMEDIATE) would block every request
+    #   in the worker, so Database runs write transactions on gevent's native
+    #   thread pool (database._run_blocking)
+    # - grpc does its own networking in C and ignores the patched sockets, so a
+    #   Gemini call over grpc would stall the worker; GeminiProvider configures
+    #   google-generativeai with transport='rest' for that reason
+    # Set GUNICORN_WORKER_CLASS=gthread to serve with real threads instead.
+    from gevent import monkey
+    monkey.patch_all()
+
+wsgi_app = 'run:app'
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5001')}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '1000'))
+
+# Load the app (and warm the reference cache) once in the master; workers share it copy-on-write
+preload_app = True
+
+# Extractions with provider fallback can take well over the default 30s
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '180'))
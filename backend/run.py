@@ -1,10 +1,31 @@
 import os
+import sys
 from dotenv import load_dotenv
-from app import create_app
 
 # Load environment variables
 load_dotenv()
 
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def serve_with_gunicorn():
+    """
+    Replace this process with gunicorn configured by gunicorn.conf.py
+    (gevent workers, 2*CPU+1 processes). Returns only if gunicorn isn't installed.
+    """
+    config = os.path.join(BACKEND_DIR, 'gunicorn.conf.py')
+    try:
+        os.execvp('gunicorn', ['gunicorn', '--chdir', BACKEND_DIR, '-c', config])
+    except FileNotFoundError:
+        print("gunicorn not found; falling back to the Flask development server", file=sys.stderr)
+
+
+# Werkzeug's dev server is single-threaded per request; only use it for local debugging
+if __name__ == '__main__' and os.getenv('FLASK_DEV_SERVER', '0') != '1':
+    serve_with_gunicorn()
+
+from app import create_app  # noqa: E402
+
 app = create_app()
 
 if __name__ == '__main__':
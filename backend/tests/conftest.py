@@ -0,0 +1,51 @@
+"""
+Shared pytest fixtures for the backend.
+Run from backend/: python -m pytest
+"""
+import os
+import sys
+
+import pytest
+
+# Keep app imports from touching the real cache directory or warming up reference data
+os.environ.setdefault('EXTRACTION_CACHE_DIR', '')
+os.environ.setdefault('DB_WARMUP', '0')
+os.environ['LOG_LEVEL'] = 'WARNING'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Database with no reference workbook and an empty extracted orders file."""
+    from app.database import Database
+    return Database(str(tmp_path / 'Case Study Data.xlsx'), str(tmp_path / 'Extracted_Orders.sqlite'))
+
+
+@pytest.fixture
+def client():
+    """Flask test client for the API."""
+    from app import create_app
+    return create_app().test_client()
+
+
+@pytest.fixture
+def make_service(tmp_path):
+    """
+    Build an ExtractionService whose providers are replaced by fakes.
+    Pass primary/fallback callables taking an ImageEnvelope and returning an ExtractionResult.
+    """
+    from app.extraction import ExtractionService
+    
+    def build(primary, fallback=None, cache_dir='', **settings):
+        service = ExtractionService(cache_dir=cache_dir)
+        for attribute, value in settings.items():
+            setattr(service, attribute, value)
+        for name, fake in ((service.primary, primary), (service.fallback, fallback)):
+            provider = service.providers[name]
+            provider.api_key = 'test-key' if fake else None
+            if fake:
+                provider.extract_from_image = fake
+        return service
+    
+    return build
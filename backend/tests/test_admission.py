@@ -0,0 +1,71 @@
+"""Tests for extraction admission control: 503 shedding and slot lifetimes."""
+import io
+import threading
+import time
+
+import pytest
+
+from app.errors import ServiceUnavailableError
+from app.extraction import ExtractionResult
+
+
+def succeed(provider):
+    def extract(image):
+        return ExtractionResult(success=True, confidence=0.9, provider=provider, data={'header': {}})
+    return extract
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.01)
+
+
+def test_full_service_sheds_with_503_and_retry_after(client, make_service, monkeypatch):
+    import app.routes as routes
+    service = make_service(succeed('openai'), max_concurrent=1, admission_timeout=0)
+    service._slots = threading.BoundedSemaphore(1)
+    service._slots.acquire()
+    monkeypatch.setattr(routes, 'get_extraction_service', lambda: service)
+    
+    response = client.post(
+        '/api/invoices/extract',
+        data={'file': (io.BytesIO(b'%PDF invoice'), 'invoice.pdf', 'application/pdf')},
+        content_type='multipart/form-data'
+    )
+    
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+    assert response.get_json()['error']['code'] == 'ERR_OVERLOADED'
+
+
+def test_slot_is_freed_after_extraction(make_service):
+    service = make_service(succeed('openai'), admission_timeout=0)
+    service._slots = threading.BoundedSemaphore(1)
+    
+    service.extract_invoice(b'%PDF one', 'application/pdf')
+    service.extract_invoice(b'%PDF two', 'application/pdf')
+    
+    assert service.get_load()['in_flight'] == 0
+
+
+def test_hedge_loser_keeps_its_slot_until_it_finishes(make_service):
+    release_primary = threading.Event()
+    
+    def slow_primary(image):
+        release_primary.wait(5)
+        return ExtractionResult(success=True, confidence=0.9, provider='openai', data={'header': {}})
+    
+    service = make_service(slow_primary, succeed('gemini'), hedge_delay=0.05, admission_timeout=0)
+    service._slots = threading.BoundedSemaphore(1)
+    
+    result = service.extract_invoice(b'%PDF one', 'application/pdf')
+    assert result.provider == 'gemini'
+    # The primary is still running, so the next extraction is shed instead of queueing behind it
+    with pytest.raises(ServiceUnavailableError):
+        service.extract_invoice(b'%PDF two', 'application/pdf')
+    
+    release_primary.set()
+    wait_until(lambda: service.get_load()['in_flight'] == 0)
+    assert service.get_load()['discarded_calls'] == 1
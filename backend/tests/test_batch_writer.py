@@ -0,0 +1,139 @@
+"""Tests for BatchWriter: coalescing saves, failure isolation and stalls."""
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from app.database import BatchWriter
+
+
+def make_order(customer_id: int, items: int = 1):
+    order = {'CustomerID': customer_id, 'TotalDue': 10.0 * items}
+    line_items = [{'ProductName': f'Item {i}', 'OrderQty': 1, 'UnitPrice': 10.0} for i in range(items)]
+    return order, line_items
+
+
+def saved_orders(database) -> int:
+    return len(database._get_extracted_table('extracted_orders', force_refresh=True))
+
+
+def job(order_data, line_items):
+    return (order_data, line_items, Future())
+
+
+def flush(writer, jobs):
+    for _, _, future in jobs:
+        future.set_running_or_notify_cancel()
+    writer._flush(jobs)
+
+
+def test_saves_queued_during_a_write_share_the_next_transaction(database, monkeypatch):
+    writer = BatchWriter(database)
+    write_orders = database._write_orders
+    batches = []
+    release_first = threading.Event()
+    
+    def recording_write(orders):
+        batches.append(len(orders))
+        if len(batches) == 1:
+            release_first.wait(5)
+        return write_orders(orders)
+    
+    monkeypatch.setattr(database, '_write_orders', recording_write)
+    
+    results = []
+    threads = [threading.Thread(target=lambda n=n: results.append(writer.submit(*make_order(n)))) for n in range(5)]
+    threads[0].start()
+    while not batches:
+        time.sleep(0.01)
+    for thread in threads[1:]:
+        thread.start()
+    while writer._queue.qsize() < 4:
+        time.sleep(0.01)
+    release_first.set()
+    for thread in threads:
+        thread.join(5)
+    
+    assert batches == [1, 4]
+    assert len({order_id for order_id, _ in results}) == 5
+    assert saved_orders(database) == 5
+
+
+def test_failing_order_only_fails_its_own_save(database):
+    writer = BatchWriter(database)
+    # sqlite3 can't bind an arbitrary object, so the combined INSERT fails
+    bad_order, bad_items = make_order(2)
+    bad_items[0]['OrderQty'] = object()
+    jobs = [job(*make_order(1)), job(bad_order, bad_items), job(*make_order(3, items=2))]
+    
+    flush(writer, jobs)
+    
+    first, bad, last = (future for _, _, future in jobs)
+    assert first.result()[0] != last.result()[0]
+    assert len(last.result()[1]) == 2
+    with pytest.raises(Exception):
+        bad.result()
+    assert saved_orders(database) == 2
+
+
+def test_cache_refresh_failure_does_not_write_orders_again(database, monkeypatch):
+    writer = BatchWriter(database)
+    
+    def broken_refresh(results):
+        raise RuntimeError("refresh failed")
+    
+    monkeypatch.setattr(database, '_orders_written', broken_refresh)
+    jobs = [job(*make_order(1)), job(*make_order(2))]
+    
+    flush(writer, jobs)
+    
+    first_id, second_id = (future.result()[0] for _, _, future in jobs)
+    assert second_id == first_id + 1
+    assert saved_orders(database) == 2
+
+
+def test_writer_thread_survives_a_crashed_flush(database, monkeypatch):
+    writer = BatchWriter(database, timeout=5)
+    flush_batch = writer._flush
+    calls = []
+    
+    def crash_once(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("flusher bug")
+        flush_batch(batch)
+    
+    monkeypatch.setattr(writer, '_flush', crash_once)
+    
+    with pytest.raises(RuntimeError, match="flusher bug"):
+        writer.submit(*make_order(1))
+    order_id, _ = writer.submit(*make_order(2))
+    
+    assert order_id > 0
+    assert saved_orders(database) == 1
+
+
+def test_submit_gives_up_on_a_save_that_never_starts(database, monkeypatch):
+    writer = BatchWriter(database, timeout=0.1)
+    write_orders = database._write_orders
+    started, release = threading.Event(), threading.Event()
+    
+    def stalled_write(orders):
+        started.set()
+        release.wait(5)
+        return write_orders(orders)
+    
+    monkeypatch.setattr(database, '_write_orders', stalled_write)
+    first = threading.Thread(target=writer.submit, args=make_order(1))
+    first.start()
+    started.wait(5)
+    
+    with pytest.raises(TimeoutError):
+        writer.submit(*make_order(2))
+    
+    release.set()
+    first.join(5)
+    # The timed-out save was cancelled, so only the first order is written
+    writer.submit(*make_order(3))
+    assert saved_orders(database) == 2
@@ -0,0 +1,49 @@
+"""Tests for the exact-match extraction cache."""
+from app.cache import ExtractionCache
+from app.extraction import ExtractionResult
+
+RESULT = {'success': True, 'confidence': 0.9, 'provider': 'openai', 'data': {'header': {'invoice_number': 'INV-1'}}}
+
+
+def test_extraction_cache_miss_then_hit(tmp_path):
+    cache = ExtractionCache(str(tmp_path), 'v1')
+    key = cache.key_for(b'invoice image')
+    
+    assert cache.get(key) is None
+    cache.put(key, RESULT, metadata={'model': 'test'})
+    assert cache.get(key) == RESULT
+    assert cache.get(cache.key_for(b'another image')) is None
+
+
+def test_extraction_cache_namespace_change_invalidates_entries(tmp_path):
+    old = ExtractionCache(str(tmp_path), 'prompt-v1|openai:gpt-4o')
+    old.put(old.key_for(b'invoice image'), RESULT)
+    
+    new = ExtractionCache(str(tmp_path), 'prompt-v2|openai:gpt-4o')
+    
+    assert new.get(new.key_for(b'invoice image')) is None
+
+
+def test_extraction_cache_ignores_unreadable_entries(tmp_path):
+    cache = ExtractionCache(str(tmp_path), 'v1')
+    key = cache.key_for(b'invoice image')
+    (tmp_path / f'{key}.json').write_bytes(b'{not json')
+    
+    assert cache.get(key) is None
+
+
+def test_service_serves_repeated_images_from_cache(tmp_path, make_service):
+    calls = []
+    
+    def provider(image):
+        calls.append(bytes(image.data))
+        return ExtractionResult(success=True, confidence=0.9, provider='openai', data={'header': {}})
+    
+    service = make_service(provider, cache_dir=str(tmp_path))
+    
+    first = service.extract_invoice(b'%PDF invoice', 'application/pdf')
+    second = service.extract_invoice(b'%PDF invoice', 'application/pdf')
+    service.extract_invoice(b'%PDF other invoice', 'application/pdf')
+    
+    assert second == first
+    assert calls == [b'%PDF invoice', b'%PDF other invoice']
@@ -0,0 +1,128 @@
+"""Tests for Database read helpers."""
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def test_sanitize_for_json_turns_missing_values_into_none(database):
+    df = pd.DataFrame({
+        'Weight': [1.5, np.nan],
+        'Color': pd.Categorical(['Red', None]),
+        'Size': ['M', None],
+        'ProductID': [1, 2],
+        'SellStartDate': pd.to_datetime(['2024-01-01', None])
+    })
+    
+    records = database._sanitize_for_json(df)
+    
+    assert records == [
+        {'Weight': 1.5, 'Color': 'Red', 'Size': 'M', 'ProductID': 1, 'SellStartDate': '2024-01-01T00:00:00'},
+        {'Weight': None, 'Color': None, 'Size': None, 'ProductID': 2, 'SellStartDate': None}
+    ]
+
+
+def seed_reference(database, sheet_key, **columns):
+    """Cache a reference sheet as if it had been loaded from the workbook."""
+    database._cache_table(f"ref_{sheet_key}", database._optimize_dtypes(pd.DataFrame(columns), categorize=True))
+
+
+@pytest.fixture
+def customers(database):
+    seed_reference(database, 'individual_customers',
+                   BusinessEntityID=[1, 2, 3], FirstName=['Ana', 'Ben', None], LastName=['Smith', 'Ng', 'Storey'])
+    seed_reference(database, 'store_customers', BusinessEntityID=[10, 11], Name=['Smith Hardware', 'Bike World'])
+    return database
+
+
+def test_search_customers_matches_names_case_insensitively(customers):
+    assert [c['business_entity_id'] for c in customers.search_customers('SMITH')] == [1, 10]
+    assert customers.search_customers('bike w') == [{'type': 'store', 'name': 'Bike World', 'business_entity_id': 11}]
+    assert customers.search_customers('zzz') == []
+    # Plain substring match: regex metacharacters are literal
+    assert customers.search_customers('.*') == []
+
+
+def test_product_and_customer_lookups_use_the_first_matching_row(database):
+    seed_reference(database, 'products', ProductNumber=['BK-1', 'FR-2', 'BK-1'], Name=['Bike', 'Frame', 'Duplicate'])
+    seed_reference(database, 'customers', CustomerID=[7, 8], AccountNumber=['AW7', 'AW8'])
+    
+    assert database.get_product_by_number('BK-1')['Name'] == 'Bike'
+    assert database.get_product_by_number('XX-9') is None
+    assert database.get_customer(8) == {'CustomerID': 8, 'AccountNumber': 'AW8'}
+    assert database.get_customer(9) is None
+
+
+def test_position_index_is_rebuilt_when_the_sheet_reloads(database):
+    seed_reference(database, 'products', ProductNumber=['BK-1'], Name=['Bike'])
+    assert database.get_product_by_number('FR-2') is None
+    
+    seed_reference(database, 'products', ProductNumber=['FR-2', 'BK-1'], Name=['Frame', 'Bike'])
+    
+    assert database.get_product_by_number('FR-2')['Name'] == 'Frame'
+    assert database.get_product_by_number('BK-1')['Name'] == 'Bike'
+
+
+def test_sorted_orders_are_rebuilt_after_a_write(database):
+    database.add_orders_with_details([({'CustomerID': 1, 'TotalDue': 10.0}, [])])
+    (first,), _ = database.get_orders()
+    
+    database.add_orders_with_details([({'CustomerID': 2, 'TotalDue': 20.0}, [])])
+    orders, total = database.get_orders()
+    
+    assert total == 2
+    assert [order['SalesOrderID'] for order in orders] == [first['SalesOrderID'] + 1, first['SalesOrderID']]
+    assert database.get_order_by_id(first['SalesOrderID'] + 1)['CustomerID'] == 2
+
+
+def test_fused_search_keeps_individuals_first_up_to_the_limit(customers):
+    assert [c['type'] for c in customers.search_customers('s')] == ['individual', 'individual', 'store']
+    assert [c['business_entity_id'] for c in customers.search_customers('s', limit=1)] == [1]
+
+
+def test_fused_search_does_not_match_across_first_and_last_name(customers):
+    assert customers.search_customers('anasmith') == []
+    assert customers.search_customers('ben ng') == []
+    assert customers.search_customers('storey')[0]['business_entity_id'] == 3
+
+
+def test_fused_search_index_is_rebuilt_when_either_sheet_reloads(customers):
+    seed_reference(customers, 'store_customers', BusinessEntityID=[12], Name=['Cycle Depot'])
+    
+    assert [c['business_entity_id'] for c in customers.search_customers('smith')] == [1]
+    assert customers.search_customers('depot')[0]['business_entity_id'] == 12
+
+
+def test_extracted_table_missing_its_load_time_is_reloaded(database):
+    database.add_orders_with_details([({'CustomerID': 1, 'TotalDue': 10.0}, [])])
+    database._cache['ext_extracted_orders'] = pd.DataFrame()
+    database._cache_time.pop('ext_extracted_orders', None)
+    
+    assert len(database._get_extracted_table('extracted_orders')) == 1
+
+
+def test_legacy_workbook_import_skips_missing_sheets(tmp_path):
+    from app.database import Database
+    legacy = tmp_path / 'Extracted_Orders.xlsx'
+    pd.DataFrame({'SalesOrderID': [75001], 'CustomerID': [5], 'TotalDue': [12.5]}).to_excel(
+        legacy, sheet_name='ExtractedOrders', index=False)
+    
+    database = Database(str(tmp_path / 'Case Study Data.xlsx'), str(tmp_path / 'Extracted_Orders.sqlite'))
+    
+    orders = database._get_extracted_table('extracted_orders')
+    assert orders['SalesOrderID'].tolist() == [75001]
+    assert database._get_extracted_table('extracted_details').empty
+
+
+@pytest.mark.filterwarnings('error::FutureWarning')
+def test_orders_from_all_sources_share_one_date_format(database):
+    seed_reference(database, 'orders', SalesOrderID=[43659], OrderDate=pd.to_datetime(['2011-05-31']),
+                   CustomerID=[29825], Status=[5], Comment=[np.nan])
+    database.add_orders_with_details([({'CustomerID': 1, 'OrderDate': '2024-05-01', 'TotalDue': 10.0}, [])])
+    
+    orders, total = database.get_orders(source='all')
+    
+    assert total == 2
+    assert [order['OrderDate'] for order in orders] == ['2024-05-01', '2011-05-31T00:00:00']
+    assert orders[1]['Status'] == 5 and isinstance(orders[1]['Status'], int)
+    assert orders[0]['Status'] is None and orders[1]['Comment'] is None
+    assert 'InvoiceNumber' in orders[1]
@@ -0,0 +1,136 @@
+"""Tests for turning raw LLM responses into extraction JSON."""
+import json
+
+import pytest
+
+from app import extraction
+from app.extraction import ExtractionResult, ImageEnvelope, LLMProvider
+
+
+class ScriptedProvider(LLMProvider):
+    """Provider whose responses come from a list; records the corrections it was sent."""
+    
+    label = "Scripted"
+    
+    def __init__(self, responses, max_output_tokens=extraction.MAX_TOKENS_PER_INVOICE):
+        self.api_key = 'test-key'
+        self.responses = list(responses)
+        self.max_output_tokens = max_output_tokens
+        self.requests = []
+    
+    @property
+    def name(self) -> str:
+        return "scripted"
+    
+    def _request(self, images, corrections):
+        self.requests.append(list(corrections))
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Backoff delays requested by the corrective loop, without actually sleeping."""
+    delays = []
+    monkeypatch.setattr(extraction.time, 'sleep', delays.append)
+    return delays
+
+
+def test_invalid_json_is_sent_back_for_correction(sleeps):
+    provider = ScriptedProvider(['{"header": ', '{"header": {}}'])
+    
+    raw_response, data = provider._request_json([ImageEnvelope(b'img')])
+    
+    assert data == {'header': {}}
+    assert raw_response == '{"header": {}}'
+    assert provider.requests[0] == []
+    assert [response for response, _ in provider.requests[1]] == ['{"header": ']
+    assert sleeps == [extraction.LLM_JSON_RETRY_BACKOFF]
+
+
+def test_corrective_turns_back_off_linearly(sleeps, monkeypatch):
+    monkeypatch.setattr(extraction, 'LLM_JSON_RETRIES', 3)
+    monkeypatch.setattr(extraction, 'LLM_JSON_RETRY_BACKOFF', 0.5)
+    provider = ScriptedProvider(['no', 'still no', 'nope', '{}'])
+    
+    assert provider._request_json([ImageEnvelope(b'img')])[1] == {}
+    assert sleeps == [0.5, 1.0, 1.5]
+
+
+def test_gives_up_after_the_configured_retries(sleeps):
+    responses = ['not json'] * (extraction.LLM_JSON_RETRIES + 1)
+    provider = ScriptedProvider(responses)
+    
+    result = provider.extract_from_image(ImageEnvelope(b'img'))
+    
+    assert not result.success
+    assert result.error.startswith('Failed to parse JSON response')
+    assert result.raw_response == 'not json'
+    assert len(provider.requests) == extraction.LLM_JSON_RETRIES + 1
+    assert len(sleeps) == extraction.LLM_JSON_RETRIES
+
+
+@pytest.mark.parametrize('response', [
+    '{"header": {"invoice_number": "INV-1"}}',
+    '```json\n{"header": {"invoice_number": "INV-1"}}\n```',
+    '```\n{"header": {"invoice_number": "INV-1"}}```',
+    'Here is the extracted invoice:\n{"header": {"invoice_number": "INV-1"}}\nLet me know if you need more.',
+    '```json\nSure! {"header": {"invoice_number": "INV-1"}} Done.\n```',
+])
+def test_json_is_recovered_from_fences_and_prose(response):
+    assert ScriptedProvider([])._parse_json_response(response) == {'header': {'invoice_number': 'INV-1'}}
+
+
+@pytest.mark.parametrize('response', ['no JSON here', 'Result: {"header": ', '{"header": {}} trailing }'])
+def test_unrecoverable_responses_raise_json_decode_error(response):
+    with pytest.raises(json.JSONDecodeError):
+        ScriptedProvider([])._parse_json_response(response)
+
+
+def test_prose_wrapped_json_needs_no_corrective_turn(sleeps):
+    provider = ScriptedProvider(['The invoice is {"header": {}} as requested.'])
+    
+    assert provider._request_json([ImageEnvelope(b'img')])[1] == {'header': {}}
+    assert len(provider.requests) == 1
+    assert sleeps == []
+
+
+def test_batch_results_map_back_by_position(sleeps):
+    provider = ScriptedProvider(['{"invoices": [{"header": {"invoice_number": "A"}}, {"header": {"invoice_number": "B"}}]}'])
+    
+    results = provider.extract_from_images([ImageEnvelope(b'a'), ImageEnvelope(b'b')])
+    
+    assert [result.data['header']['invoice_number'] for result in results] == ['A', 'B']
+    assert len(provider.requests) == 1
+
+
+def test_batch_with_wrong_invoice_count_is_extracted_one_image_at_a_time(sleeps):
+    provider = ScriptedProvider([
+        '{"invoices": [{"header": {"invoice_number": "A"}}]}',
+        '{"header": {"invoice_number": "A"}}',
+        '{"header": {"invoice_number": "B"}}',
+    ])
+    
+    results = provider.extract_from_images([ImageEnvelope(b'a'), ImageEnvelope(b'b')])
+    
+    assert all(result.success for result in results)
+    assert [result.data['header']['invoice_number'] for result in results] == ['A', 'B']
+    assert len(provider.requests) == 3
+
+
+def test_service_batch_falls_back_per_image_after_a_wrong_count(make_service):
+    seen = {'primary': [], 'fallback': []}
+    
+    def extract(provider):
+        def fake(image):
+            seen[provider].append(bytes(image.data))
+            success = provider == 'fallback' or image.data == b'a'
+            return ExtractionResult(success=success, confidence=0.9, provider=provider, data={'header': {}}, error=None if success else 'unreadable')
+        return fake
+    
+    service = make_service(primary=extract('primary'), fallback=extract('fallback'))
+    service.providers[service.primary]._request = lambda images, corrections: '{"invoices": []}'
+    
+    results = service.extract_invoice_batch([(b'a', 'image/png'), (b'b', 'image/png')])
+    
+    assert [result.provider for result in results] == ['primary', 'fallback']
+    assert seen == {'primary': [b'a', b'b'], 'fallback': [b'b']}
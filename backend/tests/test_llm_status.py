@@ -0,0 +1,44 @@
+"""Tests for /api/llm/status conditional requests."""
+import pytest
+
+import app.routes as routes
+from app.extraction import ExtractionResult
+
+
+@pytest.fixture
+def service(make_service, monkeypatch):
+    fake = lambda image: ExtractionResult(success=True, confidence=0.9, provider='openai')
+    service = make_service(fake, fake)
+    monkeypatch.setattr(routes, 'get_extraction_service', lambda: service)
+    monkeypatch.setattr(routes, '_llm_status_cache', {'expires': 0.0, 'value': None})
+    return service
+
+
+def test_status_carries_an_etag_that_must_be_revalidated(client, service):
+    response = client.get('/api/llm/status')
+    
+    assert response.status_code == 200
+    assert response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.get_json()['data']['load']['in_flight'] == 0
+
+
+def test_matching_if_none_match_gets_304(client, service):
+    etag = client.get('/api/llm/status').headers['ETag']
+    
+    response = client.get('/api/llm/status', headers={'If-None-Match': etag})
+    
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+
+
+def test_load_change_invalidates_the_etag(client, service):
+    etag = client.get('/api/llm/status').headers['ETag']
+    service._in_flight += 1
+    
+    response = client.get('/api/llm/status', headers={'If-None-Match': etag})
+    
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.get_json()['data']['load']['in_flight'] == 1
@@ -0,0 +1,27 @@
+"""Tests for the perceptual-hash extraction cache."""
+import pytest
+
+from app.cache import SemanticCache
+
+RESULT = {'success': True, 'confidence': 0.9, 'provider': 'openai', 'data': {'header': {'invoice_number': 'INV-1'}}}
+
+
+def test_semantic_cache_matches_within_max_distance(tmp_path):
+    pytest.importorskip('imagehash')
+    cache = SemanticCache(str(tmp_path), 'v1', max_distance=4)
+    phash = 0x0F0F_0F0F_0F0F_0F0F
+    cache.put(phash, RESULT)
+    
+    assert cache.get(phash ^ 0b111) == RESULT
+    assert cache.get(phash ^ 0b11111) is None
+    assert SemanticCache(str(tmp_path), 'v2').get(phash) is None
+
+
+def test_semantic_cache_errors_are_misses(tmp_path):
+    pytest.importorskip('imagehash')
+    cache = SemanticCache(str(tmp_path), 'v1')
+    with open(cache.db_path, 'wb') as f:
+        f.write(b'not a database' * 100)
+    
+    cache.put(0x0F0F, RESULT)
+    assert cache.get(0x0F0F) is None
@@ -0,0 +1,54 @@
+"""Tests for validate_extraction issue messages."""
+from app.extraction import validate_extraction
+
+
+def invoice(**overrides):
+    data = {
+        'header': {'invoice_number': 'INV-1', 'date': '2024-01-31'},
+        'line_items': [{'quantity': 2, 'unit_price': 5, 'total': 10}],
+        'totals': {'total': 10}
+    }
+    data.update(overrides)
+    return data
+
+
+def test_valid_invoice_has_no_issues():
+    assert validate_extraction(invoice()) == (True, [])
+
+
+def test_numeric_strings_are_coerced():
+    assert validate_extraction(invoice(line_items=[{'quantity': '2', 'unit_price': '5.00', 'total': '10'}])) == (True, [])
+
+
+def test_missing_fields_and_math_mismatch_are_reported():
+    is_valid, issues = validate_extraction(invoice(
+        header=None,
+        line_items=[{'quantity': 2, 'unit_price': 5, 'total': 11}],
+        totals=None
+    ))
+    
+    assert not is_valid
+    assert issues == [
+        'Missing invoice number',
+        'Missing invoice date',
+        'Line item 1: math mismatch (qty=2 × price=5 ≠ total=11)',
+        'Missing total amount'
+    ]
+
+
+def test_rounding_within_one_percent_is_accepted():
+    assert validate_extraction(invoice(line_items=[{'quantity': 3, 'unit_price': 3.33, 'total': 10}]))[0]
+
+
+def test_no_line_items_is_reported():
+    assert validate_extraction(invoice(line_items=[])) == (False, ['No line items found'])
+
+
+def test_schema_errors_name_the_line_item_and_field():
+    is_valid, issues = validate_extraction(invoice(line_items=[
+        {'quantity': 2, 'unit_price': 5, 'total': 10},
+        {'quantity': 'two', 'unit_price': 5, 'total': 10}
+    ]))
+    
+    assert not is_valid
+    assert issues == ['Line item 2: quantity - Input should be a valid number, unable to parse string as a number']
@@ -494,7 +494,8 @@ export default function ADRPage() {
                 <div className="p-2 rounded bg-muted/50 font-mono text-xs">
                   <div className="text-green-600">{`{ "success": true,`}</div>
                   <div className="pl-2">{`"data": {...},`}</div>
-                  <div className="pl-2">{`"meta": { "response_time_ms" } }`}</div>
+                  <div className="pl-2">{`"meta": { "pagination" } }`}</div>
+                  <div className="text-muted-foreground">{`Header: X-Response-Time-Ms`}</div>
                 </div>
               </div>
               <div className="space-y-2">
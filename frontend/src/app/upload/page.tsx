@@ -363,7 +363,7 @@ export default function UploadPage() {
               <Checkbox id="save-db" checked={saveToDb} onCheckedChange={(c) => setSaveToDb(c as boolean)} />
               <div className="grid gap-1.5 leading-none">
                 <Label htmlFor="save-db" className="font-medium cursor-pointer">Save to database after extraction</Label>
-                <p className="text-xs text-muted-foreground">Saves to <code className="bg-muted px-1 rounded">Extracted_Orders.xlsx</code></p>
+                <p className="text-xs text-muted-foreground">Saves to <code className="bg-muted px-1 rounded">Extracted_Orders.sqlite</code></p>
               </div>
             </div>
           </CardContent>